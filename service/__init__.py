@@ -16,6 +16,7 @@ app.config.from_object(config)
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes         # noqa: E402, E261
+from service import commands       # noqa: F401 E402
 # pylint: disable=wrong-import-position
 from .common import error_handlers  # noqa: F401 E402
 
@@ -33,4 +34,10 @@ except Exception as error:
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+if app.config["INGEST_MODE"] == "async":
+    routes.start_write_behind()  # writes spilled at the last shutdown are queued again
+
+if app.config["WARMUP_ENABLED"]:
+    routes.start_warmup()  # runs in the background, readiness is not held up
+
 app.logger.info("Service initialized!")
@@ -0,0 +1,231 @@
+"""
+Commands
+
+This module contains the flask CLI commands for maintaining recommendations
+"""
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import click
+from flask.cli import AppGroup
+from sqlalchemy.pool import SingletonThreadPool, StaticPool
+from service.models import db, DataValidationError, IdempotencyKey, Recommendation, recommendation_schema
+from service.config import ARCHIVE_BATCH_SIZE
+
+# Import Flask application
+from . import app
+
+recommendations_cli = AppGroup("recommendations", help="Maintain the recommendations")
+
+
+######################################################################
+# ARCHIVE COLD RECOMMENDATIONS
+######################################################################
+@recommendations_cli.command("archive")
+@click.option("--batch-size", default=ARCHIVE_BATCH_SIZE, show_default=True,
+              help="Recommendations moved per transaction")
+@click.option("--max-batches", default=None, type=int, help="Stop after this many batches")
+def archive(batch_size, max_batches):
+    """Moves recommendations that were never liked into the archive"""
+    archived = Recommendation.archive_cold(batch_size=batch_size, max_batches=max_batches)
+    click.echo(f"Archived {archived} cold recommendations")
+
+
+######################################################################
+# PURGE EXPIRED IDEMPOTENCY KEYS
+######################################################################
+@recommendations_cli.command("purge-keys")
+def purge_keys():
+    """Deletes the expired idempotency keys"""
+    purged = IdempotencyKey.purge()
+    click.echo(f"Purged {purged} expired idempotency keys")
+
+
+######################################################################
+# IMPORT RECOMMENDATIONS
+######################################################################
+@recommendations_cli.command("import")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]), default=None,
+              help="Format of the file, guessed from its extension by default")
+@click.option("--chunk-size", default=8 * 1024 * 1024, show_default=True, help="Bytes of the file per chunk")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True,
+              help="Processes parsing chunks and connections loading them")
+@click.option("--resume", is_flag=True, help="Skip the chunks committed by a previous run")
+def import_recommendations(path, file_format, chunk_size, workers, resume):
+    """Loads recommendations from a CSV or NDJSON file"""
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "ndjson")
+    progress_path = path + ".progress"
+    committed = set()
+    if resume and os.path.exists(progress_path):
+        with open(progress_path, encoding="utf-8") as progress_file:
+            progress = json.load(progress_file)
+        if progress["chunk_size"] != chunk_size:
+            raise click.UsageError(f"The previous run used --chunk-size {progress['chunk_size']}")
+        committed = set(progress["committed"])
+
+    chunks = split_chunks(path, chunk_size, skip_header=file_format == "csv", quoted=file_format == "csv")
+    header = read_header(path) if file_format == "csv" else None
+    todo = [index for index in range(len(chunks)) if index not in committed]
+    click.echo(f"Importing {len(todo)} of {len(chunks)} chunks of {path} with {workers} workers")
+
+    engine = db.engine
+    statement = Recommendation.insert_statement(engine.dialect.name)
+    started = time.monotonic()
+    loaded = 0
+    invalid = 0
+    with ProcessPoolExecutor(workers) as parsers, ThreadPoolExecutor(loader_count(engine, workers)) as loaders:
+        parsing = {}
+        loading = {}
+        while todo or parsing or loading:
+            # keep a bounded number of chunks in memory
+            while todo and len(parsing) + len(loading) < 2 * workers:
+                index = todo.pop(0)
+                start, end = chunks[index]
+                parsing[parsers.submit(parse_chunk, path, file_format, header, start, end)] = index
+            done, _ = wait(list(parsing) + list(loading), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in parsing:
+                    index = parsing.pop(future)
+                    rows, errors = future.result()
+                    invalid += len(errors)
+                    for line, messages in errors[:5]:
+                        click.echo(f"chunk {index} line {line}: {'; '.join(messages)}", err=True)
+                    loading[loaders.submit(load_rows, engine, statement, rows)] = index
+                else:
+                    index = loading.pop(future)
+                    loaded += future.result()
+                    committed.add(index)
+                    save_progress(progress_path, chunk_size, committed)
+                    elapsed = time.monotonic() - started
+                    click.echo(
+                        f"chunk {index + 1}/{len(chunks)} committed: {loaded} rows, "
+                        f"{loaded / elapsed if elapsed else 0:,.0f} rows/s"
+                    )
+
+    elapsed = time.monotonic() - started
+    if len(committed) == len(chunks) and os.path.exists(progress_path):
+        os.remove(progress_path)  # nothing left to resume
+    click.echo(
+        f"Imported {loaded} recommendations ({invalid} invalid) in {elapsed:.1f}s, "
+        f"{loaded / elapsed if elapsed else 0:,.0f} rows/s"
+    )
+
+
+def loader_count(engine, workers: int) -> int:
+    """Returns how many chunks can be loaded at once on the engine's connections"""
+    if isinstance(engine.pool, (StaticPool, SingletonThreadPool)):
+        return 1  # every checkout hands out the same connection
+    return workers
+
+
+def split_chunks(path: str, chunk_size: int, skip_header: bool = False, quoted: bool = False) -> list:
+    """Returns the (start, end) byte offsets of chunks of whole lines of a file
+
+    Args:
+        quoted (bool): the file is CSV, whose quoted fields may hold newlines;
+            a chunk then only ends where its double quotes are balanced
+    """
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, "rb") as data_file:
+        start = len(data_file.readline()) if skip_header else 0
+        while start < size:
+            data_file.seek(min(start + chunk_size, size))
+            data_file.readline()  # move on to the end of the line
+            end = min(data_file.tell(), size)
+            if quoted:
+                data_file.seek(start)
+                quotes = data_file.read(end - start).count(b'"')
+                while quotes % 2 and end < size:  # the line ended inside a quoted field
+                    line = data_file.readline()
+                    quotes += line.count(b'"')
+                    end += len(line)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def read_header(path: str) -> list:
+    """Returns the column names in the first line of a CSV file"""
+    with open(path, encoding="utf-8", newline="") as data_file:
+        return next(csv.reader(data_file))
+
+
+def parse_chunk(path: str, file_format: str, header: list, start: int, end: int) -> tuple:
+    """Parses and validates a chunk of a file in a worker process
+
+    Returns:
+        a list of the column values of the valid rows, and a list of the
+        row number within the chunk and the errors of each invalid row
+    """
+    with open(path, "rb") as data_file:
+        data_file.seek(start)
+        text = data_file.read(end - start).decode("utf-8")
+    if file_format == "csv":
+        # the reader splits the rows itself, keeping newlines inside quoted fields
+        records = (csv_record(header, values) for values in csv.reader(io.StringIO(text, newline="")))
+    else:
+        # only "\n" ends a line: str.splitlines() would also split on characters
+        # such as U+2028 that JSON strings may hold
+        records = (ndjson_record(line) for line in text.split("\n") if line.strip())
+    natural_key = Recommendation.natural_key
+    rows = []
+    errors = []
+    for line, record in enumerate(records, start=1):
+        values, messages = recommendation_schema.check(record)
+        if natural_key and not messages:
+            # the upsert would insert a row with a null key column on every run
+            try:
+                Recommendation.check_natural_key(values)
+            except DataValidationError as error:
+                messages = error.errors
+        if messages:
+            errors.append((line, messages))
+        else:
+            rows.append(values)
+    return rows, errors
+
+
+def csv_record(header: list, values: list) -> dict:
+    """Returns a CSV row as a dictionary, with the integer columns converted"""
+    record = dict(zip(header, values))
+    for key in ("recommendationId", "number_of_likes"):
+        value = record.get(key)
+        if value == "":
+            record[key] = None
+        elif value is not None:
+            try:
+                record[key] = int(value)
+            except ValueError:
+                pass  # left as a string for the schema to reject
+    return record
+
+
+def ndjson_record(line: str):
+    """Returns a JSON line as a dictionary, or None when it is not JSON"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def load_rows(engine, statement, rows: list) -> int:
+    """Inserts rows in one transaction on a connection of its own"""
+    if rows:
+        with engine.begin() as connection:
+            connection.execute(statement, rows)
+    return len(rows)
+
+
+def save_progress(progress_path: str, chunk_size: int, committed: set):
+    """Records the chunks committed so far so an import can be resumed"""
+    with open(progress_path + ".tmp", "w", encoding="utf-8") as progress_file:
+        json.dump({"chunk_size": chunk_size, "committed": sorted(committed)}, progress_file)
+    os.replace(progress_path + ".tmp", progress_path)
+
+
+app.cli.add_command(recommendations_cli)
@@ -0,0 +1,116 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Cache
+
+This module contains a small in-process cache with a time to live and
+least recently used eviction, safe to share between threads.
+
+Each key has a generation that invalidate() and clear() move on, so a value
+loaded while its key was being invalidated is not stored: read generation()
+before loading and store with set_if_unchanged().
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Keeps values for ttl seconds, evicting the least recently used when full"""
+
+    def __init__(self, ttl: float = 300, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._epoch = 0
+        self._generations = OrderedDict()
+
+    def get(self, key, default=None):
+        """Returns the value of a key, or default when it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Stores the value of a key"""
+        with self._lock:
+            self._store(key, value)
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def generation(self, key):
+        """Returns the generation of a key, to pass to set_if_unchanged()"""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set_if_unchanged(self, key, generation, value) -> bool:
+        """Stores the value of a key unless it was invalidated since generation() was read"""
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(key, 0)):
+                return False
+            self._store(key, value)
+            return True
+
+    def invalidate(self, key):
+        """Removes a key"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._generations.move_to_end(key)
+            if len(self._generations) > self.max_entries:
+                # a forgotten generation starts again from 0, so outdate every generation read
+                self._generations.popitem(last=False)
+                self._epoch += 1
+
+    def clear(self):
+        """Removes every key"""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """Returns the number of entries, hits and misses"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+            }
@@ -29,7 +29,14 @@ from . import status
 @app.errorhandler(DataValidationError)
 def request_validation_error(error):
     """Handles Value Errors from bad data"""
-    return bad_request(error)
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_400_BAD_REQUEST, error="Bad Request", message=message, errors=error.errors
+        ),
+        status.HTTP_400_BAD_REQUEST,
+    )
 
 
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
@@ -101,6 +108,21 @@ def mediatype_not_supported(error):
     )
 
 
+@app.errorhandler(status.HTTP_422_UNPROCESSABLE_ENTITY)
+def unprocessable_entity(error):
+    """Handles requests that cannot be processed with 422_UNPROCESSABLE_ENTITY"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        jsonify(
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            error="Unprocessable Entity",
+            message=message,
+        ),
+        status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -114,3 +136,22 @@ def internal_server_error(error):
         ),
         status.HTTP_500_INTERNAL_SERVER_ERROR,
     )
+
+
+@app.errorhandler(status.HTTP_503_SERVICE_UNAVAILABLE)
+def service_unavailable(error):
+    """Handles requests the service cannot take right now with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.warning(message)
+    headers = {}
+    if getattr(error, "retry_after", None) is not None:
+        headers["Retry-After"] = str(error.retry_after)
+    return (
+        jsonify(
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            error="Service Unavailable",
+            message=message,
+        ),
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers,
+    )
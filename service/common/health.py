@@ -0,0 +1,168 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Health
+
+This module contains utilities to report the health of a worker: the
+latency of its database calls, the saturation of its connection pool
+and a cached, rate-limited database connectivity probe.
+"""
+import threading
+import time
+from collections import deque
+from sqlalchemy import event
+
+
+class LatencyWindow:
+    """Keeps the durations recorded over the last window seconds"""
+
+    def __init__(self, window: float = 60, max_samples: int = 10000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=max_samples)
+
+    def record(self, duration: float):
+        """Records the duration of a call in seconds"""
+        with self._lock:
+            self._samples.append((time.monotonic(), duration))
+
+    def durations(self) -> list:
+        """Returns the durations recorded within the window"""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return [duration for _, duration in self._samples]
+
+    def stats(self) -> dict:
+        """Returns the number of samples and the p50 and p99 latencies in milliseconds"""
+        durations = sorted(self.durations())
+        if not durations:
+            return {"samples": 0, "p50_ms": None, "p99_ms": None}
+
+        def percentile(fraction):
+            return round(durations[min(len(durations) - 1, int(fraction * len(durations)))] * 1000, 3)
+
+        return {"samples": len(durations), "p50_ms": percentile(0.50), "p99_ms": percentile(0.99)}
+
+
+def watch_engine(engine, latency: LatencyWindow):
+    """Records the duration of every statement an engine executes
+
+    Args:
+        engine (Engine): an engine, or the Engine class to watch every engine
+        latency (LatencyWindow): where the durations are recorded
+    """
+
+    # cursor executes on a connection never nest, so one start time per
+    # watcher is enough; the key keeps watchers of the same engine apart
+    key = ("query_start", id(latency))
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        conn.info[key] = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # pylint: disable=unused-argument, too-many-arguments
+        start = conn.info.pop(key, None)
+        if start is not None:
+            latency.record(time.perf_counter() - start)
+
+    def handle_error(context):
+        # a failed statement never reaches after_cursor_execute
+        if context.connection is not None:
+            context.connection.info.pop(key, None)
+
+    if getattr(engine, "_latency_window", None) is latency:
+        return
+    engine._latency_window = latency  # pylint: disable=protected-access
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def pool_status(engine) -> dict:
+    """Returns how many connections of an engine's pool are in use"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return {"type": type(pool).__name__, "saturation": None}
+    size = pool.size()
+    checked_out = pool.checkedout()
+    max_overflow = getattr(pool, "_max_overflow", 0)
+    capacity = size + max_overflow if max_overflow >= 0 else None
+    return {
+        "type": type(pool).__name__,
+        "size": size,
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "saturation": round(checked_out / capacity, 3) if capacity else None,
+    }
+
+
+class DatabaseProbe:
+    """Checks database connectivity at most once per interval
+
+    Callers in between, and callers arriving while a check is running, get
+    the last result, so a flood of readiness requests costs one query
+    """
+
+    def __init__(self, check, interval: float = 5):
+        """
+        Args:
+            check (callable): raises an exception when the database is unreachable
+            interval (float): the minimum number of seconds between checks
+        """
+        self.check = check
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked_at = None
+
+    @property
+    def checked(self) -> bool:
+        """Whether the database has been checked yet"""
+        return self._result is not None
+
+    def status(self) -> dict:
+        """Returns the result of the last check, running a new one when it is stale"""
+        now = time.monotonic()
+        stale = self._checked_at is None or now - self._checked_at >= self.interval
+        if stale and self._lock.acquire(blocking=self._result is None):
+            try:
+                if self._checked_at is None or time.monotonic() - self._checked_at >= self.interval:
+                    self._result = self.run()
+                    self._checked_at = time.monotonic()
+            finally:
+                self._lock.release()
+        return self.last()
+
+    def last(self) -> dict:
+        """Returns the result of the last check without ever running one, or None"""
+        if self._result is None:
+            return None
+        result = dict(self._result)
+        result["age_seconds"] = round(time.monotonic() - self._checked_at, 3)
+        return result
+
+    def run(self) -> dict:
+        """Runs the check and times it"""
+        start = time.perf_counter()
+        try:
+            self.check()
+        except Exception as error:  # pylint: disable=broad-except
+            return {"ok": False, "latency_ms": None, "error": str(error)}
+        return {"ok": True, "latency_ms": round((time.perf_counter() - start) * 1000, 3), "error": None}
@@ -0,0 +1,104 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Idempotency Keys
+
+This module contains a store for the responses of requests sent with an
+Idempotency-Key header, so that a client retrying a request gets the
+original response back instead of repeating its side effects.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+NEW = "new"
+REPLAY = "replay"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+
+
+def fingerprint(data) -> bytes:
+    """Returns a compact digest of a JSON request body"""
+    return hashlib.blake2b(json.dumps(data, sort_keys=True).encode("utf-8"), digest_size=16).digest()
+
+
+class IdempotencyStore:
+    """Keeps the response of each idempotency key until its TTL expires
+
+    Entries are kept in insertion order, so expired keys are always at the
+    front and the oldest keys are evicted first when the store is full
+    """
+
+    def __init__(self, ttl: float = 86400, max_keys: int = 100000):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def begin(self, key: str, digest: bytes) -> tuple:
+        """Reserves a key for a request with the given body digest
+
+        Returns:
+            a tuple of the state (NEW, REPLAY, IN_PROGRESS or MISMATCH) and
+            the stored response when the state is REPLAY
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [now + self.ttl, digest, None]
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+                return NEW, None
+            _, stored_digest, response = entry
+            if stored_digest != digest:
+                return MISMATCH, None
+            if response is None:
+                return IN_PROGRESS, None
+            return REPLAY, response
+
+    def complete(self, key: str, response):
+        """Stores the response of a reserved key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = response
+
+    def release(self, key: str):
+        """Forgets a reserved key so that the request can be retried"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Forgets every key"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now: float):
+        """Removes the expired keys from the front of the store"""
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            del entries[key]
@@ -20,17 +20,157 @@ Log Handlers
 This module contains utility functions to set up logging
 consistently
 """
+import atexit
+import json
 import logging
+import queue
+import random
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] [%(request_id)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    """Formats log records as text, with "-" for records without a request id"""
+
+    def format(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Queues records for a QueueListener with as little work as possible
+
+    The queue never leaves the process, so only the message is rendered here
+    (its arguments may change after the call returns) and all the formatting
+    is left to the listener's handlers on the background thread
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records below WARNING for each logger
+
+    Rates are looked up by logger name and then by its parents, so a rate
+    for "sqlalchemy" also applies to "sqlalchemy.engine"
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def rate(self, name: str) -> float:
+        """Returns the sampling rate of a logger"""
+        if name not in self._resolved:
+            rate = 1.0
+            parts = name.split(".")
+            while parts:
+                prefix = ".".join(parts)
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                parts.pop()
+            self._resolved[name] = rate
+        return self._resolved[name]
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class RequestIdFilter(logging.Filter):
+    """Tags log records with the id of the request being handled"""
+
+    def filter(self, record):
+        record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+def parse_sample_rates(rates: str) -> dict:
+    """Parses sampling rates given as "logger=rate,logger=rate" """
+    parsed = {}
+    for item in filter(None, (part.strip() for part in rates.split(","))):
+        name, _, rate = item.partition("=")
+        parsed[name.strip()] = float(rate)
+    return parsed
+
+
+def init_request_id(app, header: str):
+    """Correlates every request with an id taken from, or echoed in, a header"""
+
+    @app.before_request
+    def assign_request_id():  # pylint: disable=unused-variable
+        g.request_id = request.headers.get(header) or uuid.uuid4().hex
+
+    @app.after_request
+    def return_request_id(response):  # pylint: disable=unused-variable
+        if "request_id" in g:
+            response.headers[header] = g.request_id
+        return response
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "text") == "json":
+        formatter = JsonFormatter(datefmt=DATE_FORMAT)
+    else:
+        formatter = TextFormatter(TEXT_FORMAT, DATE_FORMAT)
+    for handler in handlers:
         handler.setFormatter(formatter)
+
+    # Filters run on the calling thread, before a record is queued
+    filters = [RequestIdFilter()]
+    rates = parse_sample_rates(app.config.get("LOG_SAMPLE_RATES", ""))
+    if rates:
+        filters.append(SamplingFilter(rates))
+
+    if app.config.get("LOG_QUEUE", False):
+        # Write the records on a background thread instead of in the request
+        queue_handler = BackgroundQueueHandler(queue.SimpleQueue())
+        listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        app.extensions["log_queue_listener"] = listener
+        handlers = [queue_handler]
+    for handler in handlers:
+        for log_filter in filters:
+            handler.addFilter(log_filter)
+    app.logger.handlers = handlers
+
+    init_request_id(app, app.config.get("REQUEST_ID_HEADER", "X-Request-ID"))
     app.logger.info("Logging handler established")
@@ -0,0 +1,98 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Single Flight
+
+This module contains a utility to coalesce concurrent identical calls
+so that only one of them does the work and the others share its result.
+
+It is built on threading primitives, so it works with threaded workers
+and with gevent/eventlet workers, which patch threading to be cooperative.
+"""
+import threading
+
+
+class _Call:  # pylint: disable=too-few-public-methods
+    """An in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into a single execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._requests = 0
+        self._executions = 0
+        self._coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Calls func unless a call with the same key is already in flight
+
+        Args:
+            key (hashable): identifies calls that are interchangeable
+            func (callable): the function to call
+
+        Returns:
+            a tuple of the result and whether it was shared from another caller
+        """
+        with self._lock:
+            self._requests += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._executions += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        """Returns the number of requests, executions and coalesced requests"""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "executions": self._executions,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+    def reset(self):
+        """Resets the statistics"""
+        with self._lock:
+            self._requests = self._executions = self._coalesced = 0
@@ -0,0 +1,122 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Warm-up
+
+This module contains a background task that preloads a cache when a
+worker boots, so the first requests after a deploy do not all fall
+through to the database.
+"""
+import json
+import threading
+import time
+from collections import Counter
+
+IDLE = "idle"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def read_access_log(path: str, limit: int) -> list:
+    """Returns the most requested (name, type) keys of a recorded access log
+
+    The log has one JSON object per line with "name" and "type" fields
+    """
+    counts = Counter()
+    with open(path, encoding="utf-8") as access_log:
+        for line in access_log:
+            try:
+                entry = json.loads(line)
+                counts[(entry["name"], entry["type"])] += 1
+            except (ValueError, KeyError, TypeError):
+                continue
+    return [key for key, _ in counts.most_common(limit)]
+
+
+class Warmup:
+    """Loads a list of keys into a cache on a background thread"""
+
+    def __init__(self, app, cache, load):
+        """
+        Args:
+            app (Flask): the application whose context the loads run in
+            cache (TTLCache): the cache to fill
+            load (callable): returns the value of a key
+        """
+        self.app = app
+        self.cache = cache
+        self.load = load
+        self.state = IDLE
+        self.total = 0
+        self.loaded = 0
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    def start(self, keys):
+        """Starts warming up the cache with the keys returned by a function"""
+        if self.state == RUNNING:
+            return
+        self.state = RUNNING
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self.run, args=(keys,), name="warmup", daemon=True)
+        self._thread.start()
+
+    def run(self, keys):
+        """Loads every key into the cache"""
+        try:
+            with self.app.app_context():
+                self.app.logger.info("Warming up the cache")
+                key_list = keys()
+                self.total = len(key_list)
+                for key in key_list:
+                    generation = self.cache.generation(key)
+                    if key not in self.cache:
+                        # a write invalidating the key during the load keeps it out
+                        self.cache.set_if_unchanged(key, generation, self.load(*key))
+                    self.loaded += 1
+            self.state = DONE
+            self.app.logger.info("Warmed up %s cache entries", self.loaded)
+        except Exception as error:  # pylint: disable=broad-except
+            self.error = str(error)
+            self.state = FAILED
+            self.app.logger.error("Cache warm-up failed: %s", error)
+        finally:
+            self.finished_at = time.monotonic()
+
+    def join(self, timeout: float = None):
+        """Waits for the warm-up to finish"""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def progress(self) -> dict:
+        """Returns the state and progress of the warm-up"""
+        if self.state == DONE:
+            fraction = 1.0
+        else:
+            fraction = self.loaded / self.total if self.total else 0.0
+        end = self.finished_at or time.monotonic()
+        return {
+            "state": self.state,
+            "loaded": self.loaded,
+            "total": self.total,
+            "progress": round(fraction, 3),
+            "seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "error": self.error,
+        }
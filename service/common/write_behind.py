@@ -0,0 +1,240 @@
+######################################################################
+# Copyright 2016, 2022 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+######################################################################
+
+"""
+Write-behind Queue
+
+This module contains a bounded queue of pending writes that a background
+thread flushes in batches. Each write gets a ticket to check its status,
+and writes still pending when the process stops are spilled to disk and
+queued again the next time it starts.
+"""
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PENDING = "pending"
+COMMITTED = "committed"
+FAILED = "failed"
+
+
+class QueueFull(Exception):
+    """ Used when the queue cannot take another write """
+
+
+class WriteBehindQueue:  # pylint: disable=too-many-instance-attributes
+    """Queues writes and flushes them in batches on a background thread"""
+
+    def __init__(self, app, flush, maxsize: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 0.05, spill_path: str = "", max_tickets: int = 100000):
+        """
+        Args:
+            app (Flask): the application whose context the flushes run in
+            flush (callable): writes a list of items in one transaction and
+                returns a result for each of them
+            maxsize (int): the number of pending writes before submit() refuses more
+            batch_size (int): the largest number of writes flushed together
+            flush_interval (float): how long to wait for a batch to fill up
+            spill_path (string): where pending writes are saved on shutdown
+            max_tickets (int): the number of ticket statuses kept
+        """
+        self.app = app
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.max_tickets = max_tickets
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._tickets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Queues any spilled writes again and starts the flusher"""
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+        self._thread.start()
+        self.restore()
+
+    def stop(self, timeout: float = 10):
+        """Stops the flusher and spills the writes that are still pending"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.spill()
+
+    def submit(self, item, ticket: str = None) -> str:
+        """Queues a write and returns its ticket, or raises QueueFull"""
+        ticket = ticket or uuid.uuid4().hex
+        with self._lock:
+            self._set_status(ticket, {"status": PENDING})
+        try:
+            self._queue.put_nowait((ticket, item))
+        except queue.Full as error:
+            with self._lock:
+                self._tickets.pop(ticket, None)
+            raise QueueFull("The write queue is full") from error
+        return ticket
+
+    def status(self, ticket: str) -> dict:
+        """Returns the status of a ticket, or None when it is unknown"""
+        with self._lock:
+            result = self._tickets.get(ticket)
+            return dict(result) if result is not None else None
+
+    def stats(self) -> dict:
+        """Returns the number of pending writes and the capacity of the queue"""
+        return {"pending": self._queue.qsize(), "capacity": self._queue.maxsize}
+
+    def run(self):
+        """Flushes batches until the queue is stopped"""
+        while not self._stopping.is_set():
+            batch = self.next_batch()
+            if batch:
+                self.write(batch)
+
+    def next_batch(self) -> list:
+        """Waits for a write and collects the ones that follow it within the interval"""
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch: list):
+        """Flushes a batch, falling back to one write at a time if it fails"""
+        with self.app.app_context():
+            try:
+                results = self.flush([item for _, item in batch])
+            except Exception as error:  # pylint: disable=broad-except
+                self.app.logger.warning("Batch of %d writes failed, retrying one at a time: %s", len(batch), error)
+                for ticket, item in batch:
+                    try:
+                        result = self.flush([item])[0]
+                    except Exception as item_error:  # pylint: disable=broad-except
+                        self._finish(ticket, {"status": FAILED, "error": str(item_error)})
+                    else:
+                        self._finish(ticket, {"status": COMMITTED, "result": result})
+                return
+            for (ticket, _), result in zip(batch, results):
+                self._finish(ticket, {"status": COMMITTED, "result": result})
+
+    def spill(self):
+        """Appends the pending writes to the spill file"""
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not pending:
+            return
+        if not self.spill_path:
+            self.app.logger.error("Dropping %d pending writes: no spill file configured", len(pending))
+            return
+        lines = "".join(json.dumps({"ticket": ticket, "item": item}) + "\n" for ticket, item in pending)
+        # one append, so the lines of workers stopping together do not interleave
+        with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+            spill_file.write(lines)
+        self.app.logger.warning("Spilled %d pending writes to %s", len(pending), self.spill_path)
+
+    def restore(self):
+        """Queues the writes saved in the spill file again
+
+        Workers starting together share the spill file, so it is first renamed
+        to a name of this process's own: only one of them gets each entry. The
+        renamed file is only removed once its entries are queued, and files
+        left renamed by workers that died are taken over the same way
+        """
+        if not self.spill_path:
+            return
+        claimed = f"{self.spill_path}.{os.getpid()}"
+        for path in [self.spill_path] + self.orphaned_claims():
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue  # another worker got there first
+            self.requeue(claimed)
+            os.remove(claimed)
+
+    def orphaned_claims(self) -> list:
+        """Returns the spill files renamed by processes that are no longer running"""
+        orphaned = []
+        for path in glob.glob(glob.escape(self.spill_path) + ".*"):
+            pid = path[len(self.spill_path) + 1:]
+            if pid.isdigit() and (int(pid) == os.getpid() or not process_running(int(pid))):
+                orphaned.append(path)
+        return orphaned
+
+    def requeue(self, path: str):
+        """Queues the writes of a spill file, skipping lines that cannot be read"""
+        restored = 0
+        with open(path, encoding="utf-8") as spill_file:
+            for number, line in enumerate(spill_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    ticket, item = entry["ticket"], entry["item"]
+                except (ValueError, KeyError, TypeError) as error:
+                    # e.g. the last line of a worker killed while spilling
+                    self.app.logger.error("Skipping unreadable line %d of %s: %s", number, path, error)
+                    continue
+                with self._lock:
+                    self._set_status(ticket, {"status": PENDING})
+                self._queue.put((ticket, item))
+                restored += 1
+        self.app.logger.info("Restored %d spilled writes from %s", restored, path)
+
+    def _finish(self, ticket: str, result: dict):
+        with self._lock:
+            self._set_status(ticket, result)
+
+    def _set_status(self, ticket: str, result: dict):
+        """Records the status of a ticket, forgetting the oldest ones past the limit"""
+        self._tickets[ticket] = result
+        self._tickets.move_to_end(ticket)
+        while len(self._tickets) > self.max_tickets:
+            self._tickets.popitem(last=False)
+
+
+def process_running(pid: int) -> bool:
+    """Returns whether a process with the pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # it exists but belongs to another user
+    return True
@@ -11,6 +11,65 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+SQLALCHEMY_ENGINE_OPTIONS = {
+    # number of compiled SQL strings kept per engine for the prebuilt lookups
+    "query_cache_size": int(os.getenv("DB_QUERY_CACHE_SIZE", "500")),
+}
+
+# Optional PostgreSQL partitioning of the recommendation table:
+# "" (none), "type" (one LIST partition per type) or "name" (HASH partitions)
+RECOMMENDATION_PARTITION_BY = os.getenv("RECOMMENDATION_PARTITION_BY", "")
+RECOMMENDATION_HASH_PARTITIONS = int(os.getenv("RECOMMENDATION_HASH_PARTITIONS", "8"))
+
+# Number of cold recommendations moved to the archive per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+# Responses to requests sent with an Idempotency-Key header are kept this long,
+# in the idempotency_key table shared by every worker ("database"), or in each
+# worker's memory ("memory"). Memory keys are lost when a worker is killed, as
+# when a request times out, and a retry reaching another worker is not
+# deduplicated: that store only suits a single worker.
+# A request still running after IDEMPOTENCY_LOCK_TIMEOUT seconds (keep it above
+# the gunicorn timeout) is taken to have died, and a retry may run it again
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "database")
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+
+# Make (name, recommendationId, type) unique and turn create() into an upsert
+RECOMMENDATION_NATURAL_KEY = os.getenv("RECOMMENDATION_NATURAL_KEY", "false").lower() in ("true", "1", "yes")
+
+# Cache of the (name, type) recommendation sets served by GET /recommendations
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# Preload the hottest sets in the background when a worker boots, taken from
+# an access log of {"name": ..., "type": ...} lines, or else by most likes
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() in ("true", "1", "yes")
+WARMUP_ACCESS_LOG = os.getenv("WARMUP_ACCESS_LOG", "")
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "1000"))
+
+# Readiness: seconds between database probes, seconds of query latencies kept
+# for the p99, and the pool saturation at which the worker reports not ready
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5"))
+HEALTH_LATENCY_WINDOW = float(os.getenv("HEALTH_LATENCY_WINDOW", "60"))
+HEALTH_MAX_POOL_SATURATION = float(os.getenv("HEALTH_MAX_POOL_SATURATION", "0.9"))
+
+# "sync" creates each recommendation in its own transaction; "async" answers
+# 202 with a ticket and writes the queued recommendations in batches
+INGEST_MODE = os.getenv("INGEST_MODE", "sync")
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.05"))
+WRITE_BEHIND_SPILL_PATH = os.getenv("WRITE_BEHIND_SPILL_PATH", "write-behind.ndjson")
+
+# Logging: "text" or "json" records, written by a background queue listener
+# when LOG_QUEUE is set, with per-logger sampling of records below WARNING
+# given as "logger=rate,logger=rate", e.g. "service.models=0.1"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE = os.getenv("LOG_QUEUE", "false").lower() in ("true", "1", "yes")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+REQUEST_ID_HEADER = os.getenv("REQUEST_ID_HEADER", "X-Request-ID")
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
@@ -5,15 +5,31 @@ All of the models are stored in this module
 """
 from importlib.util import set_loader
 import logging
+from datetime import datetime, timedelta
 from enum import Enum
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, bindparam, delete, event, insert, select, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, make_transient_to_detached
+from service.common.idempotency import NEW, REPLAY, IN_PROGRESS, MISMATCH
+from service.common.single_flight import SingleFlight
+from service.config import (
+    RECOMMENDATION_PARTITION_BY, RECOMMENDATION_HASH_PARTITIONS, ARCHIVE_BATCH_SIZE, RECOMMENDATION_NATURAL_KEY,
+    IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_LOCK_TIMEOUT
+)
 
-logger = logging.getLogger("flask.app")
+# A child of app.logger (named after the "service" package), so its records
+# go through the handlers, formatting and sampling set up by init_logging
+logger = logging.getLogger(__name__)
 
 # Create the SQLAlchemy object to be initialized later in init_db()
 db = SQLAlchemy()
 
+# Concurrent identical lookups in this worker share a single database call
+lookups = SingleFlight()
+
+
 def init_db(app):
     """Initialize the SQLAlchemy app"""
     Recommendation.init_db(app)
@@ -22,26 +38,97 @@ def init_db(app):
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
+    def __init__(self, message, errors: list = None):
+        super().__init__(message)
+        self.errors = errors if errors is not None else [message]
+
 class RecommendationType(Enum):
     """Enumeration of valid Recommendation Types"""
     CROSSSELL = 0
     UPSELL = 1
     ACCESSORY = 2
 
+
+# Columns that identify the same recommendation when the natural key is enabled
+NATURAL_KEY = ("name", "recommendationId", "type")
+
+# The INSERT constructs that support ON CONFLICT, by dialect
+UPSERT_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def partition_table_args(partition_by: str) -> dict:
+    """Returns the table arguments that partition the recommendation table
+
+    Args:
+        partition_by (string): "type", "name" or "" for no partitioning
+    """
+    if partition_by == "type":
+        return {"postgresql_partition_by": "LIST (type)"}
+    if partition_by == "name":
+        return {"postgresql_partition_by": "HASH (name)"}
+    if partition_by:
+        raise ValueError(f"Cannot partition recommendations by {partition_by}")
+    return {}
+
+
+def partition_ddl(table: str, partition_by: str, partitions: int) -> list:
+    """Returns the statements that create the partitions of a partitioned table
+
+    Args:
+        table (string): the name of the partitioned table
+        partition_by (string): "type", "name" or "" for no partitioning
+        partitions (int): the number of hash partitions when partitioning by name
+    """
+    if partition_by == "type":
+        return [
+            f"CREATE TABLE IF NOT EXISTS {table}_{rec_type.name.lower()} "
+            f"PARTITION OF {table} FOR VALUES IN ('{rec_type.name}')"
+            for rec_type in RecommendationType
+        ]
+    if partition_by == "name":
+        return [
+            f"CREATE TABLE IF NOT EXISTS {table}_p{remainder} "
+            f"PARTITION OF {table} FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            for remainder in range(partitions)
+        ]
+    return []
+
+
+def recommendation_table_args(partition_by: str, natural_key: bool) -> tuple:
+    """Returns the table arguments of the recommendation table
+
+    Args:
+        partition_by (string): "type", "name" or "" for no partitioning
+        natural_key (bool): make (name, recommendationId, type) unique
+    """
+    constraints = (db.UniqueConstraint(*NATURAL_KEY, name="recommendation_natural_key"),) if natural_key else ()
+    return constraints + (partition_table_args(partition_by),)
+
+
 class Recommendation(db.Model):
     """
     Class that represents a Recommendation
     """
+    # Partitioning is PostgreSQL only: the partition key has to be part of the
+    # table's primary key, while the mapper keeps identifying rows by id alone
+    __table_args__ = recommendation_table_args(RECOMMENDATION_PARTITION_BY, RECOMMENDATION_NATURAL_KEY)
+
+    # create() upserts on the natural key instead of always inserting
+    natural_key = RECOMMENDATION_NATURAL_KEY
+
     # Table Schema
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63))
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(63), primary_key=RECOMMENDATION_PARTITION_BY == "name")
     recommendationId = db.Column(db.Integer)
     recommendationName = db.Column(db.String(63))
     type = db.Column(
-        db.Enum(RecommendationType), nullable=False, server_default=(RecommendationType.UPSELL.name)
+        db.Enum(RecommendationType), nullable=False, server_default=(RecommendationType.UPSELL.name),
+        primary_key=RECOMMENDATION_PARTITION_BY == "type"
     )
     number_of_likes = db.Column(db.Integer)
 
+    __mapper_args__ = {"primary_key": [id]}
+
     def __repr__(self):
         return f"<Recommendation {self.name} id=[{self.id}] RecommendationId=[{self.recommendationId}] RecommendationName=[{self.recommendationName}] RecommendationType=[{self.type}] number_of_likes=[{self.number_of_likes}]>"
 
@@ -51,8 +138,111 @@ class Recommendation(db.Model):
         """
         logger.info("Creating %s", self.name)
         self.id = None  # id must be none to generate next primary key
+        if self.natural_key:
+            self.upsert()
+            return
+        db.session.add(self)
+        db.session.commit()
+
+    def upsert(self):
+        """
+        Creates a Recommendation, or updates the one with the same natural key
+        This needs a unique index on (name, recommendationId, type)
+        """
+        logger.info("Upserting %s", self.name)
+        cls = type(self)
+        values = {column.key: getattr(self, column.key) for column in cls.__table__.columns if column.key != "id"}
+        cls.check_natural_key(values)
+        statement = cls.upsert_statement(db.engine.dialect.name).values(**values)
+        db.session.execute(statement)
+        self.id = db.session.execute(
+            select(cls.id).where(*[getattr(cls, key) == values[key] for key in NATURAL_KEY])
+        ).scalar_one()
+        db.session.commit()
+        # the row is in the database now, so attach this instance as its persistent
+        # copy in place of any older instance of the row the session holds
+        existing = db.session.identity_map.get(db.session.identity_key(cls, self.id))
+        if existing is not None:
+            db.session.expunge(existing)
+        make_transient_to_detached(self)
         db.session.add(self)
+
+    @staticmethod
+    def check_natural_key(values: dict):
+        """
+        Raises a DataValidationError when a column of the natural key is null
+        Nulls never conflict in a unique index, so upserting them would add a row every time
+        :param values: the column values of a recommendation
+        :type values: dict
+        """
+        errors = [f"{key} is required when the natural key is enabled" for key in NATURAL_KEY if values.get(key) is None]
+        if errors:
+            raise DataValidationError("Invalid Recommendation: " + "; ".join(errors), errors)
+
+    @classmethod
+    def upsert_statement(cls, dialect: str):
+        """
+        Returns an INSERT that updates the row with the same natural key instead
+        :param dialect: the name of the database dialect
+        :type dialect: string
+        """
+        if dialect not in UPSERT_INSERTS:
+            raise DataValidationError(f"Upsert is not supported on {dialect}")
+        statement = UPSERT_INSERTS[dialect](cls.__table__)
+        return statement.on_conflict_do_update(
+            index_elements=NATURAL_KEY,
+            set_={
+                column.key: statement.excluded[column.key]
+                for column in cls.__table__.columns
+                if column.key != "id" and column.key not in NATURAL_KEY
+            },
+        )
+
+    @classmethod
+    def insert_statement(cls, dialect: str):
+        """
+        Returns the INSERT used to load many rows at once
+        It upserts on the natural key when that is enabled
+        :param dialect: the name of the database dialect
+        :type dialect: string
+        """
+        if cls.natural_key:
+            return cls.upsert_statement(dialect)
+        return insert(cls.__table__)
+
+    @classmethod
+    def create_all(cls, items: list) -> list:
+        """
+        Creates Recommendations from a list of dictionaries in one transaction
+        With the natural key enabled they are upserted by a single executemany,
+        and items with the same natural key get the id of the same row
+        :param items: the data of the recommendations to create
+        :type items: list
+        :return: the ids of the new recommendations
+        :rtype: list
+        """
+        logger.info("Creating %d recommendations", len(items))
+        if not cls.natural_key:
+            recommendations = [cls().deserialize(data) for data in items]
+            db.session.add_all(recommendations)
+            db.session.commit()
+            return [recommendation.id for recommendation in recommendations]
+        keys = []
+        rows = {}
+        for data in items:
+            values = recommendation_schema.validate(data)
+            cls.check_natural_key(values)
+            key = tuple(values[column] for column in NATURAL_KEY)
+            keys.append(key)
+            rows[key] = values  # one row per key, as a statement cannot update a row twice
+        db.session.execute(cls.upsert_statement(db.engine.dialect.name), list(rows.values()))
+        key_columns = [getattr(cls, column) for column in NATURAL_KEY]
+        ids = {
+            tuple(row[1:]): row[0]
+            for row in db.session.execute(select(cls.id, *key_columns).where(tuple_(*key_columns).in_(list(rows))))
+        }
         db.session.commit()
+        return [ids[key] for key in keys]
 
     def update(self):
         """
@@ -88,20 +278,11 @@ class Recommendation(db.Model):
         Args:
             data (dict): A dictionary containing the resource data
         """
-        try:
-            self.name = data["name"]
-            self.number_of_likes = data["number_of_likes"]
-            self.recommendationId = data["recommendationId"]
-            self.recommendationName = data["recommendationName"]
-            self.type = getattr(RecommendationType, data["type"])
-        except AttributeError as error:
-            raise DataValidationError("Invalid attribute: " + error.args[0]) from error
-        except KeyError as error:
-            raise DataValidationError("Invalid Recommendation: missing " + error.args[0]) from error
-        except TypeError as error:
-            raise DataValidationError(
-                "Invalid Recommendation: body of request contained bad or no data " + str(error)
-            ) from error
+        values = recommendation_schema.validate(data)
+        if self.natural_key:
+            self.check_natural_key(values)
+        for key, value in values.items():
+            setattr(self, key, value)
         return self
 
     @classmethod
@@ -114,22 +295,98 @@ class Recommendation(db.Model):
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
 
+    @classmethod
+    def statement(cls, key: str):
+        """Returns the prebuilt SELECT statement for one of the lookups
+        The statements are built once with bound parameters and reused for
+        every call, so SQLAlchemy can serve the compiled SQL from its cache
+        without constructing a new Query each time
+        :param key: one of 'all', 'find_by_name', 'find_by_type' or 'find_by_name_and_type'
+        :type key: string
+        """
+        statements = cls.__dict__.get("_statements")
+        if statements is None:
+            statements = {
+                "all": select(cls),
+                "find_by_name": select(cls).where(cls.name == bindparam("name")),
+                "find_by_type": select(cls).where(cls.type == bindparam("type")),
+                "find_by_name_and_type": select(cls).where(
+                    cls.name == bindparam("name"), cls.type == bindparam("type")
+                ),
+            }
+            cls._statements = statements
+        return statements[key]
+
+    @classmethod
+    def coalesce(cls, key: str, lookup, *args):
+        """Runs a read lookup once for all concurrent identical callers
+        Callers that shared another caller's result get copies of its rows
+        built in their own session, since sessions are not shared between
+        threads. A session with changes that are not committed yet runs the
+        lookup on its own, so the changes are neither shared nor skipped
+        :param key: the name of the lookup
+        :type key: string
+        :param lookup: the function that queries the database
+        :type lookup: callable
+        """
+        session = db.session
+        if session.new or session.dirty or session.deleted or session.info.get("flushed"):
+            return lookup(*args)
+        (result, rows), shared = lookups.do((cls.__name__, key) + args, cls.shareable(lookup), *args)
+        if not shared:
+            return result
+        if isinstance(rows, list):
+            return [cls.from_row(row) for row in rows]
+        return cls.from_row(rows)
+
+    @classmethod
+    def shareable(cls, lookup):
+        """Wraps a lookup to also return plain copies of the rows it found"""
+
+        def run(*args):
+            result = lookup(*args)
+            if isinstance(result, list):
+                return result, [cls.to_row(instance) for instance in result]
+            return result, cls.to_row(result)
+        return run
+
+    @classmethod
+    def to_row(cls, instance) -> dict:
+        """Returns the column values of an instance, or None"""
+        if instance is None:
+            return None
+        return {column.key: getattr(instance, column.key) for column in cls.__table__.columns}
+
+    @classmethod
+    def from_row(cls, row: dict):
+        """Returns the instance of a row in the current session, or None"""
+        if row is None:
+            return None
+        instance = cls(**row)
+        make_transient_to_detached(instance)  # as if it had been loaded
+        return db.session.merge(instance, load=False)
+
     @classmethod
     def all(cls) -> list:
         """Returns all of the recommendations in the database"""
         logger.info("Processing all recommendations")
-        return cls.query.all()
+        return db.session.execute(cls.statement("all")).scalars().all()
 
     @classmethod
-    def find(cls, reco_id: int):
+    def find(cls, reco_id: int, include_archived: bool = False):
         """Finds a recmmendation by it's ID
         :param reco_id: the id of the recmmendation to find
         :type reco_id: int
+        :param include_archived: fall through to the archive when it is not found
+        :type include_archived: bool
         :return: an instance with the reco_id, or None if not found
         :rtype: recmmendation
         """
         logger.info("Processing lookup for id %s ...", reco_id)
-        return cls.query.get(reco_id)
+        found = cls.coalesce("find", lambda reco_id: db.session.get(cls, reco_id), reco_id)
+        if found is None and include_archived:
+            found = RecommendationArchive.find(reco_id)
+        return found
 
     @classmethod
     def find_or_404(cls, recommendation_id: int):
@@ -143,14 +400,22 @@ class Recommendation(db.Model):
         return cls.query.get_or_404(recommendation_id)
 
     @classmethod
-    def find_by_name(cls, name)-> list:
+    def find_by_name(cls, name, include_archived: bool = False)-> list:
         """Returns all recmmendationModels with the given name
 
         Args:
             name (string): the name of the recmmendationModels you want to match
+            include_archived (bool): also return the archived recmmendationModels
         """
         logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        found = cls.coalesce(
+            "find_by_name",
+            lambda name: db.session.execute(cls.statement("find_by_name"), {"name": name}).scalars().all(),
+            name,
+        )
+        if include_archived:
+            found = found + RecommendationArchive.find_by_name(name)
+        return found
     
     @classmethod
     def find_by_type(cls, type: RecommendationType = RecommendationType.UPSELL) -> list:
@@ -161,4 +426,414 @@ class Recommendation(db.Model):
         :rtype: list
         """
         logger.info("Processing type query for %s ...", type.name)
-        return cls.query.filter(cls.type == type)
\ No newline at end of file
+        return cls.coalesce(
+            "find_by_type",
+            lambda type: db.session.execute(cls.statement("find_by_type"), {"type": type}).scalars().all(),
+            type,
+        )
+
+    @classmethod
+    def find_by_name_and_type(cls, name, type: RecommendationType) -> list:
+        """Returns the set of recommendations with the given name and type
+        :param name: the name of the recommendations to match
+        :type name: string
+        :param type: the type of the recommendations to match
+        :type type: RecommendationType
+        :rtype: list
+        """
+        logger.info("Processing name and type query for %s %s ...", name, type.name)
+        return cls.coalesce(
+            "find_by_name_and_type",
+            lambda name, type: db.session.execute(
+                cls.statement("find_by_name_and_type"), {"name": name, "type": type}
+            ).scalars().all(),
+            name,
+            type,
+        )
+
+    @classmethod
+    def hottest(cls, limit: int) -> list:
+        """Returns the (name, type) pairs with the most likes, hottest first
+        :param limit: the number of pairs to return
+        :type limit: int
+        :rtype: list
+        """
+        logger.info("Processing hottest %s recommendation sets ...", limit)
+        likes = db.func.sum(cls.number_of_likes)
+        rows = db.session.execute(
+            select(cls.name, cls.type).group_by(cls.name, cls.type).order_by(likes.desc().nullslast()).limit(limit)
+        ).all()
+        return [(name, rec_type) for name, rec_type in rows]
+
+    @classmethod
+    def filter_by_criteria(cls, name: str = None, type: RecommendationType = None):
+        """Returns a query for the recommendations matching the given criteria
+        :param name: the name of the recommendations to match
+        :type name: string
+        :param type: the type of the recommendations to match
+        :type type: RecommendationType
+        :return: a query that has not been executed
+        :rtype: Query
+        """
+        query = cls.query
+        if name is not None:
+            query = query.filter(cls.name == name)
+        if type is not None:
+            query = query.filter(cls.type == type)
+        return query
+
+    @classmethod
+    def bulk_update(cls, values: dict, name: str = None, type: RecommendationType = None,
+                    dry_run: bool = False) -> int:
+        """Updates every recommendation matching the criteria with a single UPDATE
+        The rows are never loaded into the session
+        :param values: a dictionary of column names and their new values
+        :type values: dict
+        :param dry_run: only count the rows that would be updated
+        :type dry_run: bool
+        :return: the number of rows affected
+        :rtype: int
+        """
+        logger.info("Processing bulk update for name=%s type=%s dry_run=%s ...", name, type, dry_run)
+        if not values:
+            raise DataValidationError("Bulk update called with no values")
+        query = cls.filter_by_criteria(name, type)
+        if dry_run:
+            return query.count()
+        count = query.update(values, synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def bulk_delete(cls, name: str = None, type: RecommendationType = None, dry_run: bool = False) -> int:
+        """Deletes every recommendation matching the criteria with a single DELETE
+        The rows are never loaded into the session
+        :param dry_run: only count the rows that would be deleted
+        :type dry_run: bool
+        :return: the number of rows affected
+        :rtype: int
+        """
+        logger.info("Processing bulk delete for name=%s type=%s dry_run=%s ...", name, type, dry_run)
+        query = cls.filter_by_criteria(name, type)
+        if dry_run:
+            return query.count()
+        count = query.delete(synchronize_session=False)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def archive_cold(cls, batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: int = None) -> int:
+        """Moves the recommendations that were never liked into the archive
+        Each batch is copied and deleted in its own transaction, so the job
+        can be stopped at any point without losing or duplicating rows
+        :param batch_size: the number of recommendations moved per transaction
+        :type batch_size: int
+        :param max_batches: stop after this many batches, or None to run until done
+        :type max_batches: int
+        :return: the number of recommendations archived
+        :rtype: int
+        """
+        logger.info("Processing archival of cold recommendations ...")
+        columns = [column.name for column in cls.__table__.columns]
+        archived = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            ids = db.session.execute(
+                select(cls.id).where(cls.number_of_likes == 0).order_by(cls.id).limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).scalars().all()
+            if not ids:
+                break
+            # a row liked since the SELECT is neither copied nor deleted
+            cold = (cls.id.in_(ids), cls.number_of_likes == 0)
+            db.session.execute(
+                insert(RecommendationArchive.__table__).from_select(
+                    columns, select(*[cls.__table__.c[column] for column in columns]).where(*cold)
+                )
+            )
+            moved = db.session.execute(delete(cls.__table__).where(*cold)).rowcount
+            db.session.commit()
+            archived += moved
+            batches += 1
+        logger.info("Archived %s cold recommendations in %s batches", archived, batches)
+        return archived
+
+
+@event.listens_for(Session, "after_flush")
+def remember_flush(session, flush_context):  # pylint: disable=unused-argument
+    """Marks a session whose transaction holds writes that are not committed"""
+    session.info["flushed"] = True
+
+
+@event.listens_for(Session, "after_transaction_end")
+def forget_flush(session, transaction):
+    """Clears the mark when the session's transaction ends"""
+    if transaction.parent is None:
+        session.info.pop("flushed", None)
+
+
+for partition in partition_ddl(Recommendation.__tablename__, RECOMMENDATION_PARTITION_BY,
+                               RECOMMENDATION_HASH_PARTITIONS):
+    event.listen(Recommendation.__table__, "after_create", DDL(partition).execute_if(dialect="postgresql"))
+
+
+class RecommendationArchive(db.Model):
+    """
+    Class that represents an archived Recommendation
+    """
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(63), index=True)
+    recommendationId = db.Column(db.Integer)
+    recommendationName = db.Column(db.String(63))
+    type = db.Column(
+        db.Enum(RecommendationType), nullable=False, server_default=(RecommendationType.UPSELL.name)
+    )
+    number_of_likes = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    def __repr__(self):
+        return f"<RecommendationArchive {self.name} id=[{self.id}] archived_at=[{self.archived_at}]>"
+
+    def serialize(self):
+        """ Serializes an archived Recommendation into a dictionary """
+        data = Recommendation.serialize(self)
+        data["archived_at"] = self.archived_at.isoformat() if self.archived_at else None
+        return data
+
+    @classmethod
+    def find(cls, reco_id: int):
+        """Finds an archived recommendation by it's ID"""
+        logger.info("Processing archive lookup for id %s ...", reco_id)
+        return db.session.get(cls, reco_id)
+
+    @classmethod
+    def find_by_name(cls, name) -> list:
+        """Returns all archived recommendations with the given name"""
+        logger.info("Processing archive name query for %s ...", name)
+        return db.session.execute(select(cls).where(cls.name == name)).scalars().all()
+
+
+class IdempotencyKey(db.Model):
+    """
+    Class that represents the response to a request sent with an Idempotency-Key
+
+    The keys are shared by every worker, so a retry is answered with the
+    original response whichever worker it reaches. The class has the same
+    begin/complete/release interface as the in-process IdempotencyStore
+    """
+    # a reserved key is given up if its request does not complete in time, as
+    # when its worker was killed; a completed key is kept for the TTL
+    ttl = IDEMPOTENCY_KEY_TTL
+    lock_timeout = IDEMPOTENCY_LOCK_TIMEOUT
+
+    # Table Schema
+    key = db.Column(db.String(255), primary_key=True)
+    digest = db.Column(db.LargeBinary(16), nullable=False)
+    response = db.Column(db.JSON)  # null until the request completes
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.key} expires_at=[{self.expires_at}]>"
+
+    @classmethod
+    def begin(cls, key: str, digest: bytes) -> tuple:
+        """Reserves a key for a request with the given body digest
+        :param key: the Idempotency-Key header of the request
+        :type key: string
+        :param digest: the fingerprint of the request body
+        :type digest: bytes
+        :return: the state (NEW, REPLAY, IN_PROGRESS or MISMATCH) and the stored response when replaying
+        :rtype: tuple
+        """
+        logger.info("Processing idempotency key %s ...", key)
+        now = datetime.utcnow()
+        db.session.execute(delete(cls.__table__).where(cls.key == key, cls.expires_at <= now))
+        statement = UPSERT_INSERTS[db.engine.dialect.name](cls.__table__).values(
+            key=key, digest=digest, response=None, expires_at=now + timedelta(seconds=cls.lock_timeout)
+        )
+        reserved = db.session.execute(statement.on_conflict_do_nothing(index_elements=["key"])).rowcount == 1
+        row = None if reserved else db.session.execute(
+            select(cls.digest, cls.response).where(cls.key == key)
+        ).one_or_none()
+        db.session.commit()
+        if reserved:
+            return NEW, None
+        if row is None:
+            return IN_PROGRESS, None  # released since the INSERT, so the other request failed
+        if row.digest != digest:
+            return MISMATCH, None
+        if row.response is None:
+            return IN_PROGRESS, None
+        message, code, headers = row.response
+        return REPLAY, (message, code, headers)
+
+    @classmethod
+    def complete(cls, key: str, response: tuple):
+        """Stores the (message, code, headers) response of a reserved key"""
+        logger.info("Completing idempotency key %s ...", key)
+        db.session.execute(
+            update(cls.__table__).where(cls.key == key).values(
+                response=list(response), expires_at=datetime.utcnow() + timedelta(seconds=cls.ttl)
+            )
+        )
+        db.session.commit()
+
+    @classmethod
+    def release(cls, key: str):
+        """Forgets a reserved key so that the request can be retried"""
+        logger.info("Releasing idempotency key %s ...", key)
+        db.session.rollback()  # the request may have failed in the middle of a transaction
+        db.session.execute(delete(cls.__table__).where(cls.key == key))
+        db.session.commit()
+
+    @classmethod
+    def purge(cls) -> int:
+        """Deletes the expired keys and returns how many there were"""
+        logger.info("Purging expired idempotency keys ...")
+        count = db.session.execute(delete(cls.__table__).where(cls.expires_at <= datetime.utcnow())).rowcount
+        db.session.commit()
+        return count
+
+    @classmethod
+    def clear(cls):
+        """Forgets every key"""
+        db.session.execute(delete(cls.__table__))
+        db.session.commit()
+
+
+# The size of each integer column type, most specific first, as PostgreSQL stores them
+INTEGER_BITS = ((db.SmallInteger, 16), (db.BigInteger, 64), (db.Integer, 32))
+
+
+class RecommendationSchema:
+    """
+    Validates recommendation payloads against rules compiled from a table
+
+    The rules (type, maximum length, nullability and enum membership of each
+    column) are worked out once, so validating a payload is a single pass over
+    its fields that reports every error instead of stopping at the first one
+    """
+
+    def __init__(self, model, exclude=("id",)):
+        self.model = model
+        self.checks = tuple(
+            (column.key, self.compile_check(column))
+            for column in model.__table__.columns
+            if column.key not in exclude
+        )
+        self.fields = frozenset(key for key, _ in self.checks)
+
+    @classmethod
+    def compile_check(cls, column):
+        """Returns a function that converts a value for the column or returns an error"""
+        column_type = column.type
+        if isinstance(column_type, db.Enum) and column_type.enum_class is not None:
+            return cls.enum_check(column)
+        if isinstance(column_type, db.String):
+            return cls.string_check(column)
+        if isinstance(column_type, db.Integer):
+            return cls.integer_check(column)
+
+        def check(value):
+            return value, None
+        return check
+
+    @staticmethod
+    def enum_check(column):
+        """Returns a check that a value is the name of a member of the column's enum"""
+        members = column.type.enum_class.__members__
+
+        def check(value):
+            if isinstance(value, str) and value in members:
+                return members[value], None
+            return None, f"{column.key} must be one of {', '.join(members)}"
+        return check
+
+    @staticmethod
+    def string_check(column):
+        """Returns a check that a value is a string that fits the column"""
+        nullable = column.nullable
+        length = column.type.length
+
+        def check(value):
+            if value is None and nullable:
+                return None, None
+            if not isinstance(value, str):
+                return None, f"{column.key} must be a string"
+            if length is not None and len(value) > length:
+                return None, f"{column.key} must be at most {length} characters"
+            return value, None
+        return check
+
+    @staticmethod
+    def integer_check(column):
+        """Returns a check that a value is an integer within the range of the column"""
+        nullable = column.nullable
+        bits = next(bits for integer_type, bits in INTEGER_BITS if isinstance(column.type, integer_type))
+        low, high = -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+
+        def check(value):
+            if value is None and nullable:
+                return None, None
+            if type(value) is not int:  # bool is an int subclass but not a valid integer here
+                return None, f"{column.key} must be an integer"
+            if not low <= value <= high:
+                return None, f"{column.key} must be between {low} and {high}"
+            return value, None
+        return check
+
+    def validate(self, data: dict, partial: bool = False) -> dict:
+        """Returns the column values of a payload or raises every error found
+
+        Args:
+            data (dict): the payload to validate
+            partial (bool): only validate the fields present, and reject unknown fields
+        """
+        values, errors = self.check(data, partial)
+        if errors:
+            raise DataValidationError("Invalid Recommendation: " + "; ".join(errors), errors)
+        return values
+
+    def check(self, data: dict, partial: bool = False) -> tuple:
+        """Returns the column values of a payload and a list of the errors found"""
+        if not isinstance(data, dict):
+            return {}, ["body of request contained bad or no data"]
+        values = {}
+        errors = []
+        for key, check in self.checks:
+            if key not in data:
+                if not partial:
+                    errors.append(f"missing {key}")
+                continue
+            value, error = check(data[key])
+            if error is None:
+                values[key] = value
+            else:
+                errors.append(error)
+        if partial:
+            errors.extend(f"unknown field {key}" for key in data if key not in self.fields)
+            if not data:
+                errors.append("body of request contained no data")
+        return values, errors
+
+    def validate_batch(self, items: list) -> tuple:
+        """Validates many payloads at once
+
+        Returns:
+            a list of the column values of the valid payloads, and a dictionary
+            of the errors of the invalid payloads keyed by their position
+        """
+        check = self.check
+        valid = []
+        invalid = {}
+        for index, data in enumerate(items):
+            values, errors = check(data)
+            if errors:
+                invalid[index] = errors
+            else:
+                valid.append(values)
+        return valid, invalid
+
+
+recommendation_schema = RecommendationSchema(Recommendation)
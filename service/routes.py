@@ -3,14 +3,34 @@ My Service
 
 Describe what your service does here
 """
-
+import atexit
 from flask import Flask, jsonify, request, url_for, make_response, abort
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import ServiceUnavailable
 from .common import status  # HTTP Status Codes
-from service.models import Recommendation
+from .common import idempotency
+from .common.write_behind import PENDING, QueueFull, WriteBehindQueue
+from .common.cache import TTLCache
+from .common.health import DatabaseProbe, LatencyWindow, pool_status, watch_engine
+from .common.warmup import Warmup, read_access_log
+from service.models import db, lookups, IdempotencyKey, Recommendation, RecommendationType, recommendation_schema
 
 # Import Flask application
 from . import app
 
+# Responses of the requests sent with an Idempotency-Key, in the database shared
+# by every worker, or only in this worker's memory
+if app.config["IDEMPOTENCY_STORE"] == "memory":
+    idempotency_keys = idempotency.IdempotencyStore(
+        ttl=app.config["IDEMPOTENCY_KEY_TTL"], max_keys=app.config["IDEMPOTENCY_MAX_KEYS"]
+    )
+else:
+    idempotency_keys = IdempotencyKey
+
+# Serialized recommendation sets keyed by (name, type name), kept per worker
+recommendation_sets = TTLCache(ttl=app.config["CACHE_TTL"], max_entries=app.config["CACHE_MAX_ENTRIES"])
+
 
 ######################################################################
 # GET INDEX
@@ -27,6 +47,81 @@ def index():
         status.HTTP_200_OK,
     )
 
+
+######################################################################
+# LIVENESS
+######################################################################
+@app.route("/health/live")
+def live():
+    """ Reports that the worker is alive and able to answer requests """
+    return jsonify(status="OK"), status.HTTP_200_OK
+
+
+######################################################################
+# READINESS
+######################################################################
+@app.route("/health/ready")
+def ready():
+    """
+    Reports whether the worker is ready to take traffic
+    The worker is not ready when the database cannot be reached or its
+    connection pool is too saturated to serve another request in time
+    """
+    pool = pool_status(db.engine)
+    saturated = pool["saturation"] is not None and pool["saturation"] >= app.config["HEALTH_MAX_POOL_SATURATION"]
+    if saturated:
+        # a probe would only wait for a connection, so report the last result
+        database = db_probe.last() or {"ok": False, "error": "pool saturated"}
+    else:
+        database = db_probe.status()
+    is_ready = database["ok"] and not saturated
+    return (
+        jsonify(
+            status="OK" if is_ready else "UNAVAILABLE",
+            database=dict(database, latency=db_latency.stats()),
+            pool=pool,
+            warmup=warmup.progress(),
+            cache=recommendation_sets.stats(),
+            coalescing=lookups.stats(),
+            ingest=write_behind.stats(),
+        ),
+        status.HTTP_200_OK if is_ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+    )
+
+
+######################################################################
+# LIST RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations", methods=["GET"])
+def list_recommendations():
+    """
+    Lists the Recommendations
+    This endpoint will return the Recommendations matching the optional name
+    and type query parameters. Sets matching both are served from the cache
+    """
+    app.logger.info("Request to list recommendations")
+    name = request.args.get("name")
+    rec_type = get_type_arg()
+    if name is not None and rec_type is not None:
+        key = (name, rec_type.name)
+        results = recommendation_sets.get(key)
+        if results is None:
+            generation = recommendation_sets.generation(key)
+            results = load_recommendation_set(*key)
+            # not cached when a write invalidated the set while it was loading
+            recommendation_sets.set_if_unchanged(key, generation, results)
+    else:
+        if name is not None:
+            recommendations = Recommendation.find_by_name(name)
+        elif rec_type is not None:
+            recommendations = Recommendation.find_by_type(rec_type)
+        else:
+            recommendations = Recommendation.all()
+        results = [recommendation.serialize() for recommendation in recommendations]
+    app.logger.info("Returning %d recommendations", len(results))
+    return jsonify(results), status.HTTP_200_OK
+
+
 ######################################################################
 # CREATE A RECOMMENDATION
 ######################################################################
@@ -35,18 +130,131 @@ def create_recommendations():
     """
     Creates a Recommendation
     This endpoint will create a Recommendation based the data in the body that is posted
+    A request retried with the same Idempotency-Key header gets the original response
     """
     app.logger.info("Request to create a recommendation")
     check_content_type("application/json")
+    data = request.get_json()
+    key = request.headers.get("Idempotency-Key")
+    if key:
+        replay = begin_idempotent_request(key, data)
+        if replay is not None:
+            return replay
+    try:
+        if app.config["INGEST_MODE"] == "async":
+            message, code, headers = queue_recommendation(data)
+        else:
+            message, code, headers = create_recommendation(data)
+    except Exception:
+        if key:
+            idempotency_keys.release(key)
+        raise
+    if key:
+        idempotency_keys.complete(key, (message, code, headers))
+    return jsonify(message), code, headers
+
+
+def begin_idempotent_request(key, data):
+    """Returns the stored response of a repeated Idempotency-Key, or None for a new one"""
+    state, response = idempotency_keys.begin(key, idempotency.fingerprint(data))
+    if state == idempotency.REPLAY:
+        app.logger.info("Replaying the response for Idempotency-Key [%s].", key)
+        message, code, headers = response
+        return jsonify(message), code, dict(headers, **{"Idempotent-Replayed": "true"})
+    if state == idempotency.IN_PROGRESS:
+        abort(status.HTTP_409_CONFLICT, f"A request with Idempotency-Key {key} is in progress")
+    if state == idempotency.MISMATCH:
+        abort(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            f"Idempotency-Key {key} was already used with a different request body",
+        )
+    return None
+
+
+def create_recommendation(data):
+    """Creates a recommendation and returns the message, code and headers of the response"""
     recommendation = Recommendation()
-    recommendation.deserialize(request.get_json())
+    recommendation.deserialize(data)
     recommendation.create()
-    message = recommendation.serialize()
+    recommendation_sets.invalidate((recommendation.name, recommendation.type.name))
     # location_url = url_for("get_recommendation", recommendation_id=recommendation.id, _external=True)
-
     app.logger.info("Recommendation with ID [%s] created.", recommendation.id)
-    return jsonify(message), status.HTTP_201_CREATED #, {"Location": location_url}
+    return recommendation.serialize(), status.HTTP_201_CREATED, {}
+
+
+def queue_recommendation(data):
+    """Queues a recommendation for the write-behind queue and returns the response for its ticket"""
+    Recommendation().deserialize(data)  # reject bad data now, not when it is flushed
+    try:
+        ticket = write_behind.submit(data)
+    except QueueFull as error:
+        app.logger.warning("Write queue is full, asking the client to retry")
+        raise ServiceUnavailable(str(error), retry_after=1) from error
+    app.logger.info("Recommendation queued with ticket [%s].", ticket)
+    headers = {"Location": url_for("get_ticket", ticket=ticket, _external=True)}
+    return {"ticket": ticket, "status": PENDING}, status.HTTP_202_ACCEPTED, headers
+
 
+######################################################################
+# READ A CREATE TICKET
+######################################################################
+@app.route("/recommendations/tickets/<ticket>", methods=["GET"])
+def get_ticket(ticket):
+    """
+    Reads the status of a queued Recommendation
+    This endpoint will return whether the Recommendation of a ticket is still
+    pending, was committed (with its id) or failed
+    """
+    app.logger.info("Request for ticket [%s]", ticket)
+    result = write_behind.status(ticket)
+    if result is None:
+        abort(status.HTTP_404_NOT_FOUND, f"Ticket '{ticket}' was not found.")
+    message = {"ticket": ticket, "status": result["status"]}
+    if "result" in result:
+        message["id"] = result["result"]
+    if "error" in result:
+        message["error"] = result["error"]
+    return jsonify(message), status.HTTP_200_OK
+
+
+######################################################################
+# BULK UPDATE RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations", methods=["PATCH"])
+def bulk_update_recommendations():
+    """
+    Updates all of the Recommendations matching a filter
+    This endpoint will update every Recommendation matching the name and/or type
+    query parameters with the data in the body, without loading them
+    """
+    app.logger.info("Request to bulk update recommendations")
+    check_content_type("application/json")
+    name, rec_type, dry_run = get_bulk_criteria()
+    values = recommendation_schema.validate(request.get_json(), partial=True)
+    count = Recommendation.bulk_update(values, name=name, type=rec_type, dry_run=dry_run)
+    if not dry_run:
+        recommendation_sets.clear()
+    app.logger.info("Bulk update matched [%s] recommendations.", count)
+    return jsonify(count=count, dry_run=dry_run), status.HTTP_200_OK
+
+
+######################################################################
+# BULK DELETE RECOMMENDATIONS
+######################################################################
+@app.route("/recommendations", methods=["DELETE"])
+def bulk_delete_recommendations():
+    """
+    Deletes all of the Recommendations matching a filter
+    This endpoint will delete every Recommendation matching the name and/or type
+    query parameters, without loading them
+    """
+    app.logger.info("Request to bulk delete recommendations")
+    name, rec_type, dry_run = get_bulk_criteria()
+    count = Recommendation.bulk_delete(name=name, type=rec_type, dry_run=dry_run)
+    if not dry_run:
+        recommendation_sets.clear()
+    app.logger.info("Bulk delete matched [%s] recommendations.", count)
+    return jsonify(count=count, dry_run=dry_run), status.HTTP_200_OK
 
 
 ######################################################################
@@ -58,6 +266,102 @@ def init_db():
     """ Initializes the SQLAlchemy app """
     global app
     Recommendation.init_db(app)
+    # every Engine, since re-initializing the app replaces the engine
+    watch_engine(Engine, db_latency)
+
+
+def check_database():
+    """Raises an exception when the database cannot be reached"""
+    with db.engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+# Latencies of the database calls made by this worker, for the p99 in readiness
+db_latency = LatencyWindow(window=app.config["HEALTH_LATENCY_WINDOW"])
+
+# Connectivity check shared by every readiness request within the interval
+db_probe = DatabaseProbe(check_database, interval=app.config["HEALTH_PROBE_INTERVAL"])
+
+
+def load_recommendation_set(name, type_name):
+    """Returns the serialized recommendations with a name and type"""
+    recommendations = Recommendation.find_by_name_and_type(name, RecommendationType[type_name])
+    return [recommendation.serialize() for recommendation in recommendations]
+
+
+def warmup_keys():
+    """Returns the hottest (name, type) sets to preload into the cache"""
+    limit = app.config["WARMUP_TOP_N"]
+    if app.config["WARMUP_ACCESS_LOG"]:
+        keys = read_access_log(app.config["WARMUP_ACCESS_LOG"], limit)
+        return [(name, type_name) for name, type_name in keys if type_name in RecommendationType.__members__]
+    return [(name, rec_type.name) for name, rec_type in Recommendation.hottest(limit)]
+
+
+# Preloads the cache in the background without holding up readiness
+warmup = Warmup(app, recommendation_sets, load_recommendation_set)
+
+
+def start_warmup():
+    """Starts warming up the cache of recommendation sets"""
+    warmup.start(warmup_keys)
+
+
+def flush_recommendations(items):
+    """Creates a batch of queued recommendations in one transaction
+    A failed batch is rolled back, so the session is usable again when the
+    queue retries its writes one at a time
+    """
+    try:
+        ids = Recommendation.create_all(items)
+    except Exception:
+        db.session.rollback()
+        raise
+    for data in items:
+        recommendation_sets.invalidate((data["name"], data["type"]))
+    return ids
+
+
+# Recommendations accepted with 202 and written in batches in the background
+write_behind = WriteBehindQueue(
+    app,
+    flush_recommendations,
+    maxsize=app.config["WRITE_BEHIND_QUEUE_SIZE"],
+    batch_size=app.config["WRITE_BEHIND_BATCH_SIZE"],
+    flush_interval=app.config["WRITE_BEHIND_FLUSH_INTERVAL"],
+    spill_path=app.config["WRITE_BEHIND_SPILL_PATH"],
+)
+
+
+def start_write_behind():
+    """Starts flushing queued recommendations and spills them at exit"""
+    write_behind.start()
+    atexit.register(write_behind.stop)
+
+
+def get_type_arg():
+    """Returns the RecommendationType of the type query parameter, if any"""
+    type_name = request.args.get("type")
+    if type_name is None:
+        return None
+    try:
+        return RecommendationType[type_name.upper()]
+    except KeyError:
+        return abort(status.HTTP_400_BAD_REQUEST, f"Invalid type: {type_name}")
+
+
+def get_bulk_criteria():
+    """Returns the name, type and dry_run query parameters of a bulk request"""
+    name = request.args.get("name")
+    if name is None and "type" not in request.args:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Bulk requests must be filtered by name and/or type",
+        )
+    rec_type = get_type_arg()
+    dry_run = request.args.get("dry_run", "false").lower() in ("true", "1", "yes")
+    return name, rec_type, dry_run
+
 
 def check_content_type(content_type):
     """Checks that the media type is correct"""
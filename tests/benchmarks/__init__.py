@@ -0,0 +1,18 @@
+"""
+Micro-benchmarks
+
+These are not collected as tests. Run each module on its own, e.g.
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m tests.benchmarks.bench_lookups
+"""
+import timeit
+
+
+def per_call(func, number: int, repeat: int = 3) -> float:
+    """Returns the best time of a function over a number of calls, in microseconds per call"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def report(label: str, before: float, after: float):
+    """Prints the per-call times of the old and the new code path"""
+    print(f"  {label:<32} {before:9.1f} us/call -> {after:9.1f} us/call")
@@ -0,0 +1,83 @@
+"""
+Benchmark of logging on the request thread
+
+Times app.logger.info() inside a request, and a whole GET request that logs
+one INFO record, for each logging mode set up by init_logging(). The second
+table uses a handler that blocks on every write, like a slow disk or pipe
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m tests.benchmarks.bench_logging
+"""
+import atexit
+import logging
+import os
+import tempfile
+import time
+from flask import Flask
+from service.common import log_handlers
+from tests.benchmarks import per_call
+
+CALLS = 20000
+REQUESTS = 2000
+MODES = {
+    "text, sync": {},
+    "json, sync": {"LOG_FORMAT": "json"},
+    "json, queue": {"LOG_FORMAT": "json", "LOG_QUEUE": True},
+    "json, queue, 10% sampled": {"LOG_FORMAT": "json", "LOG_QUEUE": True, "LOG_SAMPLE_RATES": "bench=0.1"},
+}
+
+
+class SlowFileHandler(logging.FileHandler):
+    """A file handler that blocks for 50us on every write"""
+
+    def emit(self, record):
+        time.sleep(0.00005)
+        super().emit(record)
+
+
+def make_app(config: dict, handler: logging.Handler) -> Flask:
+    """Returns an app logging through the handler in one of the modes"""
+    source = logging.getLogger("bench.gunicorn")
+    source.handlers = [handler]
+    source.setLevel(logging.INFO)
+    app = Flask("bench")
+    app.config.update(config)
+
+    @app.route("/")
+    def index():  # pylint: disable=unused-variable
+        app.logger.info("Request for Root URL")
+        return "OK"
+
+    log_handlers.init_logging(app, "bench.gunicorn")
+    return app
+
+
+def run(handler_class, directory: str):
+    """Prints the per-call cost of each logging mode"""
+    print(f"  {'':<28} {'info() us/call':>15} {'GET / us/request':>17}")
+    for mode, config in MODES.items():
+        handler = handler_class(os.path.join(directory, "bench.log"))
+        app = make_app(config, handler)
+        client = app.test_client()
+        with app.test_request_context("/"):
+            app.preprocess_request()  # assigns the request id
+            info = per_call(lambda: app.logger.info("Processing lookup for id %s ...", 42), CALLS)
+        request = per_call(lambda: client.get("/"), REQUESTS)
+        listener = app.extensions.get("log_queue_listener")
+        if listener:
+            atexit.unregister(listener.stop)
+            listener.stop()
+        handler.close()
+        print(f"  {mode:<28} {info:15.1f} {request:17.1f}")
+
+
+def main():
+    """Times every mode with a plain and with a slow file handler"""
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{CALLS} info() calls and {REQUESTS} requests, best of 3, FileHandler in {directory}")
+        run(logging.FileHandler, directory)
+        print("with a handler that blocks 50us per write:")
+        run(SlowFileHandler, directory)
+
+
+if __name__ == "__main__":
+    main()
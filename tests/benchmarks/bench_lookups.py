@@ -0,0 +1,54 @@
+"""
+Benchmark of the recommendation lookups
+
+Compares building a Query for every call, as the lookups used to do, with
+the prebuilt statements of Recommendation.statement() and Session.get()
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m tests.benchmarks.bench_lookups
+"""
+from service.models import db, Recommendation, RecommendationArchive
+from tests.benchmarks import per_call, report
+from tests.factories import seed_recommendations
+from tests.harness import init_test_db
+
+CALLS = 5000
+ROWS = 200
+
+
+def uncached(lookup, *args):
+    """Runs a lookup with an empty identity map"""
+    db.session.expunge_all()
+    return lookup(*args)
+
+
+def main():
+    """Seeds the table and times each lookup both ways"""
+    init_test_db()
+    db.session.query(Recommendation).delete()
+    db.session.query(RecommendationArchive).delete()
+    seed_recommendations(ROWS)
+    first = Recommendation.all()[0]
+    reco_id, name, rec_type = first.id, first.name, first.type
+    print(f"{CALLS} calls, best of 3, {ROWS} rows, {db.engine.dialect.name}")
+    report(
+        "find_by_name",
+        per_call(lambda: Recommendation.query.filter(Recommendation.name == name).all(), CALLS),
+        per_call(lambda: Recommendation.find_by_name(name), CALLS),
+    )
+    report(
+        f"find_by_type ({len(Recommendation.find_by_type(rec_type))} rows)",
+        per_call(lambda: Recommendation.query.filter(Recommendation.type == rec_type).all(), CALLS),
+        per_call(lambda: Recommendation.find_by_type(rec_type), CALLS),
+    )
+    # empty the identity map first, or neither way goes to the database
+    report(
+        "find",
+        per_call(lambda: uncached(Recommendation.query.get, reco_id), CALLS),
+        per_call(lambda: uncached(Recommendation.find, reco_id), CALLS),
+    )
+    db.session.query(Recommendation).delete()
+    db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
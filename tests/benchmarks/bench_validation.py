@@ -0,0 +1,67 @@
+"""
+Benchmark of payload validation
+
+Compares Recommendation.deserialize() with the key lookups it used to do,
+and times recommendation_schema on its own and in batches
+
+    DATABASE_URI=sqlite:////tmp/bench.db python -m tests.benchmarks.bench_validation
+"""
+from service.models import DataValidationError, Recommendation, RecommendationType, recommendation_schema
+from tests.benchmarks import per_call, report
+from tests.factories import RecommendationFactory
+
+CALLS = 20000
+BATCH = 1000
+
+
+def legacy_deserialize(recommendation, data: dict):
+    """The deserialize() that only looked up keys, before the compiled schema"""
+    try:
+        recommendation.name = data["name"]
+        recommendation.number_of_likes = data["number_of_likes"]
+        recommendation.recommendationId = data["recommendationId"]
+        recommendation.recommendationName = data["recommendationName"]
+        recommendation.type = getattr(RecommendationType, data["type"])
+    except AttributeError as error:
+        raise DataValidationError("Invalid attribute: " + error.args[0]) from error
+    except KeyError as error:
+        raise DataValidationError("Invalid Recommendation: missing " + error.args[0]) from error
+    except TypeError as error:
+        raise DataValidationError("Invalid Recommendation: body of request contained bad or no data") from error
+    return recommendation
+
+
+def rejected(deserialize, data: dict):
+    """Deserializes a payload that is expected to be invalid"""
+    try:
+        deserialize(Recommendation(), data)
+    except DataValidationError:
+        pass
+
+
+def main():
+    """Times valid and invalid payloads through the old and the new path"""
+    valid = RecommendationFactory().serialize()
+    del valid["id"]
+    invalid = dict(valid)
+    del invalid["name"]
+    print(f"{CALLS} calls, best of 3")
+    report(
+        "deserialize, valid payload",
+        per_call(lambda: legacy_deserialize(Recommendation(), valid), CALLS),
+        per_call(lambda: Recommendation().deserialize(valid), CALLS),
+    )
+    report(
+        "deserialize, invalid payload",
+        per_call(lambda: rejected(legacy_deserialize, invalid), CALLS),
+        per_call(lambda: rejected(Recommendation.deserialize, invalid), CALLS),
+    )
+    validate = per_call(lambda: recommendation_schema.validate(valid), CALLS)
+    print(f"  recommendation_schema.validate alone: {validate:.2f} us per payload")
+    items = [valid] * BATCH
+    batch = per_call(lambda: recommendation_schema.validate_batch(items), 100)
+    print(f"  validate_batch of {BATCH} payloads: {batch / 1000:.2f} ms ({BATCH / batch * 1e6:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,11 @@ Test Factory to make fake objects for testing
 
 import factory
 from factory.fuzzy import FuzzyChoice
-from service.models import Recommendation, RecommendationType
+from sqlalchemy import insert
+from service.models import db, Recommendation, RecommendationType
+
+# Rows per INSERT, so the bound parameters stay within SQLite's limit of 32766
+SEED_ROWS_PER_STATEMENT = 5000
 
 
 class RecommendationFactory(factory.Factory):
@@ -21,3 +25,20 @@ class RecommendationFactory(factory.Factory):
     recommendationName = factory.Faker("name")
     type = FuzzyChoice(choices=[RecommendationType.UPSELL, RecommendationType.CROSSSELL, RecommendationType.ACCESSORY])
     number_of_likes = factory.Sequence(lambda n:n)
+
+
+def seed_recommendations(count, **kwargs):
+    """Inserts fake recommendations with multi-row INSERTs and returns their data
+
+    The rows never go through the session, so thousands of them take a
+    single statement instead of one INSERT each
+    """
+    columns = [column.key for column in Recommendation.__table__.columns if column.key != "id"]
+    rows = [
+        {column: getattr(recommendation, column) for column in columns}
+        for recommendation in RecommendationFactory.build_batch(count, **kwargs)
+    ]
+    for start in range(0, len(rows), SEED_ROWS_PER_STATEMENT):
+        db.session.execute(insert(Recommendation.__table__).values(rows[start:start + SEED_ROWS_PER_STATEMENT]))
+    db.session.commit()
+    return rows
@@ -0,0 +1,94 @@
+"""
+Test cases for the TTLCache and the cache warm-up
+
+"""
+import json
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.cache import TTLCache
+from service.common.warmup import read_access_log
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestTTLCache(TestCase):
+    """ Test Cases for TTLCache """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.cache = TTLCache(ttl=10, max_entries=2)
+
+    def test_get_and_set(self):
+        """It should return stored values and count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", [])
+        self.assertEqual(self.cache.get("a", "missing"), [])
+        self.assertIn("a", self.cache)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_expiry(self):
+        """It should not return expired values"""
+        with patch("service.common.cache.time.monotonic", return_value=100.0):
+            self.cache.set("a", 1)
+        with patch("service.common.cache.time.monotonic", return_value=110.0):
+            self.assertNotIn("a", self.cache)
+            self.assertIsNone(self.cache.get("a"))
+            self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """It should evict the least recently used value when full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIn("a", self.cache)
+        self.assertNotIn("b", self.cache)
+
+    def test_invalidate_and_clear(self):
+        """It should remove one or every value"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.invalidate("a")
+        self.assertNotIn("a", self.cache)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_set_if_unchanged(self):
+        """It should not store a value loaded while its key was invalidated"""
+        generation = self.cache.generation("a")
+        self.assertTrue(self.cache.set_if_unchanged("a", generation, 1))
+        generation = self.cache.generation("a")
+        self.cache.invalidate("a")
+        self.assertFalse(self.cache.set_if_unchanged("a", generation, 2))
+        self.assertNotIn("a", self.cache)
+        generation = self.cache.generation("b")
+        self.cache.clear()
+        self.assertFalse(self.cache.set_if_unchanged("b", generation, 3))
+        self.assertTrue(self.cache.set_if_unchanged("b", self.cache.generation("b"), 3))
+
+    def test_forgotten_generation(self):
+        """It should outdate every generation read when it forgets one"""
+        generation = self.cache.generation("a")
+        for key in ("b", "c", "d"):
+            self.cache.invalidate(key)
+        self.assertFalse(self.cache.set_if_unchanged("a", generation, 1))
+
+    def test_read_access_log(self):
+        """It should return the most requested keys of an access log"""
+        lines = [{"name": "prodA", "type": "UPSELL"}] * 3 + [{"name": "prodB", "type": "ACCESSORY"}] * 2
+        lines.append({"name": "prodC", "type": "UPSELL"})
+        with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as access_log:
+            for line in lines:
+                access_log.write(json.dumps(line) + "\n")
+            access_log.write("not json\n")
+        try:
+            keys = read_access_log(access_log.name, 2)
+        finally:
+            os.remove(access_log.name)
+        self.assertEqual(keys, [("prodA", "UPSELL"), ("prodB", "ACCESSORY")])
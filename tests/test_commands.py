@@ -0,0 +1,186 @@
+"""
+Test cases for the recommendations CLI commands
+
+"""
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+from sqlalchemy.pool import QueuePool, StaticPool
+from service import app
+from service.models import IdempotencyKey, Recommendation
+from service.commands import recommendations_cli, split_chunks, parse_chunk, read_header, loader_count
+from tests.factories import RecommendationFactory
+from tests.harness import DatabaseTestCase
+
+
+######################################################################
+#  C O M M A N D   T E S T   C A S E S
+######################################################################
+class TestRecommendationCommands(DatabaseTestCase):
+    """ CLI Command Tests """
+
+    # the import command loads rows on connections of its own
+    transactional = False
+
+    def setUp(self):
+        """ This runs before each test """
+        super().setUp()
+        self.runner = app.test_cli_runner()
+
+    def write_file(self, name, lines):
+        """Writes lines to a temporary file and returns its path"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as data_file:
+            data_file.write("\n".join(lines) + "\n")
+        return path
+
+    def ndjson_lines(self, count):
+        """Returns NDJSON lines of fake recommendations"""
+        lines = []
+        for recommendation in RecommendationFactory.build_batch(count):
+            data = recommendation.serialize()
+            del data["id"]
+            lines.append(json.dumps(data))
+        return lines
+
+    def test_archive(self):
+        """It should archive cold recommendations from the command line"""
+        for recommendation in RecommendationFactory.create_batch(3, number_of_likes=0):
+            recommendation.create()
+        RecommendationFactory(number_of_likes=5).create()
+        result = self.runner.invoke(recommendations_cli, ["archive", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Archived 3 cold recommendations", result.output)
+        self.assertEqual(len(Recommendation.all()), 1)
+
+    def test_purge_keys(self):
+        """It should purge the expired idempotency keys from the command line"""
+        with patch.object(IdempotencyKey, "lock_timeout", 0):
+            IdempotencyKey.begin("key-1", b"digest")
+        result = self.runner.invoke(recommendations_cli, ["purge-keys"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Purged 1 expired idempotency keys", result.output)
+
+    def test_loader_count(self):
+        """It should only load one chunk at a time on a single shared connection"""
+        self.assertEqual(loader_count(MagicMock(pool=MagicMock(spec=QueuePool)), 4), 4)
+        self.assertEqual(loader_count(MagicMock(pool=MagicMock(spec=StaticPool)), 4), 1)
+
+    def test_split_chunks(self):
+        """It should split a file into chunks of whole lines"""
+        path = self.write_file("data.csv", ["header", "a" * 10, "b" * 10, "c" * 10])
+        chunks = split_chunks(path, 12, skip_header=True)
+        self.assertEqual(chunks, [(7, 29), (29, 40)])
+        with open(path, "rb") as data_file:
+            data = data_file.read()
+        self.assertEqual(data[7:29], b"aaaaaaaaaa\nbbbbbbbbbb\n")
+
+    def test_split_chunks_quoted(self):
+        """It should not end a CSV chunk on a newline inside a quoted field"""
+        path = self.write_file("data.csv", ["header", 'a,"b\nc"', "d,e"])
+        chunks = split_chunks(path, 4, skip_header=True, quoted=True)
+        self.assertEqual(chunks, [(7, 15), (15, 19)])
+        rows, errors = parse_chunk(path, "csv", ["name", "recommendationName"], *chunks[0])
+        self.assertEqual(errors[0][0], 1)
+        self.assertNotIn("missing recommendationName", errors[0][1])
+        self.assertEqual(len(rows) + len(errors), 1)
+
+    def test_parse_chunk_bad_integer(self):
+        """It should report an integer column that int() cannot read as an invalid row"""
+        lines = ["name,recommendationId,recommendationName,type,number_of_likes",
+                 "prodA,\u00b2,prodB,UPSELL,5", "prodC,3,prodD,UPSELL,"]
+        path = self.write_file("data.csv", lines)
+        (start, end), = split_chunks(path, 1024, skip_header=True, quoted=True)
+        rows, errors = parse_chunk(path, "csv", read_header(path), start, end)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(errors, [(1, ["recommendationId must be an integer"])])
+
+    def test_parse_chunk_null_natural_key(self):
+        """It should count rows with a null natural key column as invalid when upserting"""
+        record = dict(RecommendationFactory().serialize(), recommendationId=None)
+        path = self.write_file("data.ndjson", [json.dumps(record)] * 3)
+        chunk = split_chunks(path, 1024)[0]
+        self.assertEqual(len(parse_chunk(path, "ndjson", None, *chunk)[0]), 3)
+        with patch.object(Recommendation, "natural_key", True):
+            rows, errors = parse_chunk(path, "ndjson", None, *chunk)
+        self.assertEqual(rows, [])
+        self.assertEqual(errors[2], (3, ["recommendationId is required when the natural key is enabled"]))
+
+    def test_import_null_natural_key(self):
+        """It should not import rows with a null natural key column when upserting"""
+        record = dict(RecommendationFactory().serialize(), recommendationId=None)
+        path = self.write_file("data.ndjson", [json.dumps(record)] * 3)
+        with patch.object(Recommendation, "natural_key", True):
+            result = self.runner.invoke(recommendations_cli, ["import", path, "--workers", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 0 recommendations (3 invalid)", result.output)
+        self.assertEqual(Recommendation.all(), [])
+
+    def test_parse_chunk_ndjson_line_separators(self):
+        """It should only split NDJSON lines on newlines"""
+        record = RecommendationFactory().serialize()
+        record["recommendationName"] = "one\u2028two\x0bthree\x1cfour"
+        path = self.write_file("data.ndjson", [json.dumps(record, ensure_ascii=False)])
+        rows, errors = parse_chunk(path, "ndjson", None, *split_chunks(path, 1024)[0])
+        self.assertEqual(errors, [])
+        self.assertEqual(rows[0]["recommendationName"], "one\u2028two\x0bthree\x1cfour")
+
+    def test_parse_chunk(self):
+        """It should validate every row of a chunk with the deserialize rules"""
+        lines = ["name,recommendationId,recommendationName,type,number_of_likes",
+                 "prodA,2,prodB,UPSELL,5", "prodC,x,prodD,SELL,", "prodE,3,prodF,ACCESSORY,"]
+        path = self.write_file("data.csv", lines)
+        (start, end), = split_chunks(path, 1024, skip_header=True)
+        rows, errors = parse_chunk(path, "csv", read_header(path), start, end)
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["recommendationId"], 2)
+        self.assertIsNone(rows[1]["number_of_likes"])
+        self.assertEqual(errors[0][0], 2)
+        self.assertEqual(len(errors[0][1]), 2)
+
+    def test_import_ndjson(self):
+        """It should import an NDJSON file in chunks and report invalid rows"""
+        lines = self.ndjson_lines(40)
+        lines.insert(3, '{"name": "prodA"}')
+        lines.insert(7, "not json")
+        path = self.write_file("data.ndjson", lines)
+        result = self.runner.invoke(
+            recommendations_cli, ["import", path, "--chunk-size", "500", "--workers", "2"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 40 recommendations (2 invalid)", result.output)
+        self.assertEqual(len(Recommendation.all()), 40)
+        self.assertFalse(os.path.exists(path + ".progress"))
+
+    def test_import_csv(self):
+        """It should import a CSV file"""
+        lines = ["name,recommendationId,recommendationName,type,number_of_likes"]
+        for recommendation in RecommendationFactory.build_batch(10):
+            lines.append(f"{recommendation.name},{recommendation.recommendationId},"
+                         f"{recommendation.recommendationName},{recommendation.type.name},3")
+        path = self.write_file("data.csv", lines)
+        result = self.runner.invoke(recommendations_cli, ["import", path, "--workers", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(Recommendation.all()), 10)
+
+    def test_import_resume(self):
+        """It should skip the chunks committed by a previous run"""
+        path = self.write_file("data.ndjson", self.ndjson_lines(20))
+        chunks = split_chunks(path, 400)
+        with open(path + ".progress", "w", encoding="utf-8") as progress_file:
+            json.dump({"chunk_size": 400, "committed": [0]}, progress_file)
+        skipped = len(parse_chunk(path, "ndjson", None, *chunks[0])[0])
+        result = self.runner.invoke(
+            recommendations_cli, ["import", path, "--chunk-size", "400", "--workers", "2", "--resume"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(len(Recommendation.all()), 20 - skipped)
+        # a different chunk size cannot be resumed
+        with open(path + ".progress", "w", encoding="utf-8") as progress_file:
+            json.dump({"chunk_size": 400, "committed": [0]}, progress_file)
+        result = self.runner.invoke(recommendations_cli, ["import", path, "--chunk-size", "500", "--resume"])
+        self.assertNotEqual(result.exit_code, 0)
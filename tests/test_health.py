@@ -0,0 +1,93 @@
+"""
+Test cases for the health utilities
+
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from service.common.health import DatabaseProbe, LatencyWindow, pool_status, watch_engine
+
+
+######################################################################
+#  H E A L T H   T E S T   C A S E S
+######################################################################
+class TestHealth(TestCase):
+    """ Test Cases for the health utilities """
+
+    def test_latency_percentiles(self):
+        """It should report the p50 and p99 latencies of the window"""
+        latency = LatencyWindow(window=60)
+        self.assertEqual(latency.stats(), {"samples": 0, "p50_ms": None, "p99_ms": None})
+        for millis in range(1, 101):
+            latency.record(millis / 1000)
+        stats = latency.stats()
+        self.assertEqual(stats["samples"], 100)
+        self.assertEqual(stats["p50_ms"], 51.0)
+        self.assertEqual(stats["p99_ms"], 100.0)
+
+    def test_latency_window_slides(self):
+        """It should forget latencies older than the window"""
+        latency = LatencyWindow(window=10)
+        with patch("service.common.health.time.monotonic", return_value=100.0):
+            latency.record(1.0)
+        with patch("service.common.health.time.monotonic", return_value=105.0):
+            latency.record(0.002)
+        with patch("service.common.health.time.monotonic", return_value=112.0):
+            self.assertEqual(latency.durations(), [0.002])
+
+    def test_watch_engine(self):
+        """It should record statements and keep no start time after a failed one"""
+        engine = create_engine("sqlite://")
+        latency = LatencyWindow(window=60)
+        watch_engine(engine, latency)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            for _ in range(5):
+                self.assertRaises(OperationalError, connection.execute, text("SELECT * FROM missing"))
+            starts = [key for key in connection.info if isinstance(key, tuple) and key[0] == "query_start"]
+            self.assertEqual(starts, [])
+            connection.execute(text("SELECT 1"))
+        self.assertEqual(latency.stats()["samples"], 2)
+        engine.dispose()
+
+    def test_probe_is_rate_limited(self):
+        """It should only check the database once per interval"""
+        check = MagicMock()
+        probe = DatabaseProbe(check, interval=60)
+        self.assertFalse(probe.checked)
+        self.assertTrue(probe.status()["ok"])
+        self.assertTrue(probe.status()["ok"])
+        self.assertEqual(check.call_count, 1)
+        self.assertTrue(probe.checked)
+
+    def test_probe_last_never_checks(self):
+        """It should return the last result without running a check"""
+        check = MagicMock()
+        probe = DatabaseProbe(check, interval=0)
+        self.assertIsNone(probe.last())
+        probe.status()
+        self.assertTrue(probe.last()["ok"])
+        self.assertIn("age_seconds", probe.last())
+        self.assertEqual(check.call_count, 1)
+
+    def test_probe_failure(self):
+        """It should report a database that cannot be reached"""
+        probe = DatabaseProbe(MagicMock(side_effect=OSError("connection refused")), interval=0)
+        result = probe.status()
+        self.assertFalse(result["ok"])
+        self.assertEqual(result["error"], "connection refused")
+        self.assertIsNone(result["latency_ms"])
+
+    def test_pool_status(self):
+        """It should report the saturation of a queue pool"""
+        engine = MagicMock()
+        engine.pool.size.return_value = 5
+        engine.pool.checkedout.return_value = 9
+        engine.pool.overflow.return_value = 4
+        engine.pool._max_overflow = 5  # pylint: disable=protected-access
+        status = pool_status(engine)
+        self.assertEqual(status["checked_out"], 9)
+        self.assertEqual(status["saturation"], 0.9)
+        engine.pool = object()
+        self.assertIsNone(pool_status(engine)["saturation"])
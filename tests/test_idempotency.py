@@ -0,0 +1,63 @@
+"""
+Test cases for the IdempotencyStore
+
+"""
+from unittest import TestCase
+from unittest.mock import patch
+from service.common import idempotency
+from service.common.idempotency import IdempotencyStore, fingerprint
+
+
+######################################################################
+#  I D E M P O T E N C Y   T E S T   C A S E S
+######################################################################
+class TestIdempotencyStore(TestCase):
+    """ Test Cases for IdempotencyStore """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.store = IdempotencyStore(ttl=10, max_keys=3)
+        self.digest = fingerprint({"name": "prodA"})
+
+    def test_fingerprint(self):
+        """It should fingerprint equal bodies the same regardless of key order"""
+        self.assertEqual(fingerprint({"a": 1, "b": 2}), fingerprint({"b": 2, "a": 1}))
+        self.assertNotEqual(fingerprint({"a": 1}), fingerprint({"a": 2}))
+        self.assertEqual(len(self.digest), 16)
+
+    def test_replay(self):
+        """It should replay the stored response of a completed key"""
+        self.assertEqual(self.store.begin("key", self.digest), (idempotency.NEW, None))
+        self.assertEqual(self.store.begin("key", self.digest), (idempotency.IN_PROGRESS, None))
+        self.store.complete("key", {"id": 1})
+        self.assertEqual(self.store.begin("key", self.digest), (idempotency.REPLAY, {"id": 1}))
+
+    def test_mismatch(self):
+        """It should not replay a key used with a different body"""
+        self.store.begin("key", self.digest)
+        self.store.complete("key", {"id": 1})
+        self.assertEqual(self.store.begin("key", fingerprint({"name": "prodB"})), (idempotency.MISMATCH, None))
+
+    def test_release(self):
+        """It should forget a released key"""
+        self.store.begin("key", self.digest)
+        self.store.release("key")
+        self.assertEqual(self.store.begin("key", self.digest), (idempotency.NEW, None))
+
+    def test_expiry(self):
+        """It should forget keys once their TTL expires"""
+        with patch("service.common.idempotency.time.monotonic", return_value=100.0):
+            self.store.begin("key", self.digest)
+            self.store.complete("key", {"id": 1})
+        with patch("service.common.idempotency.time.monotonic", return_value=111.0):
+            self.assertEqual(self.store.begin("key", self.digest), (idempotency.NEW, None))
+            self.assertEqual(len(self.store), 1)
+
+    def test_eviction(self):
+        """It should evict the oldest keys when it is full"""
+        for key in ("a", "b", "c", "d"):
+            self.store.begin(key, self.digest)
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(self.store.begin("a", self.digest), (idempotency.NEW, None))
+        self.store.clear()
+        self.assertEqual(len(self.store), 0)
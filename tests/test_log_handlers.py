@@ -0,0 +1,144 @@
+"""
+Test cases for the logging set up
+
+"""
+import atexit
+import json
+import logging
+import sys
+from unittest import TestCase
+from logging.handlers import QueueHandler
+from flask import Flask
+from service import models
+from service.common import log_handlers
+from service.common.log_handlers import JsonFormatter, SamplingFilter, parse_sample_rates
+
+
+class ListHandler(logging.Handler):
+    """Keeps the formatted records in a list"""
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+######################################################################
+#  L O G   H A N D L E R   T E S T   C A S E S
+######################################################################
+class TestLogHandlers(TestCase):
+    """ Test Cases for the logging set up """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.handler = ListHandler()
+        self.source = logging.getLogger("tests.gunicorn")
+        self.source.handlers = [self.handler]
+        self.source.setLevel(logging.INFO)
+
+    def tearDown(self):
+        """ This runs after each test """
+        self.source.handlers = []
+
+    def make_app(self, name="tests", **config):
+        """Creates an app with logging set up from the config"""
+        app = Flask(name)
+        app.config.update(config)
+
+        @app.route("/")
+        def index():  # pylint: disable=unused-variable
+            app.logger.info("Request for Root URL")
+            return "OK"
+
+        log_handlers.init_logging(app, "tests.gunicorn")
+        return app
+
+    def test_text_format(self):
+        """It should log text records by default"""
+        self.make_app()
+        self.assertIn("[INFO] [log_handlers] [-] Logging handler established", self.handler.lines[-1])
+
+    def test_text_format_with_request_id(self):
+        """It should include the request id in text records"""
+        app = self.make_app()
+        app.test_client().get("/", headers={"X-Request-ID": "abc123"})
+        self.assertIn("[abc123] Request for Root URL", self.handler.lines[-1])
+
+    def test_json_format_with_request_id(self):
+        """It should log JSON records tagged with the request id"""
+        app = self.make_app(LOG_FORMAT="json")
+        response = app.test_client().get("/", headers={"X-Request-ID": "abc123"})
+        self.assertEqual(response.headers["X-Request-ID"], "abc123")
+        entry = json.loads(self.handler.lines[-1])
+        self.assertEqual(entry["message"], "Request for Root URL")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["request_id"], "abc123")
+
+    def test_request_id_generated(self):
+        """It should generate a request id when the client sends none"""
+        app = self.make_app()
+        response = app.test_client().get("/")
+        self.assertTrue(response.headers["X-Request-ID"])
+
+    def test_queue_handler(self):
+        """It should write the records on a background thread"""
+        app = self.make_app(LOG_FORMAT="json", LOG_QUEUE=True)
+        self.assertIsInstance(app.logger.handlers[0], QueueHandler)
+        app.test_client().get("/", headers={"X-Request-ID": "queued"})
+        listener = app.extensions["log_queue_listener"]
+        atexit.unregister(listener.stop)
+        listener.stop()  # flushes the queue
+        entries = [json.loads(line) for line in self.handler.lines]
+        self.assertIn("queued", [entry.get("request_id") for entry in entries])
+
+    def test_model_records_sampled_and_queued(self):
+        """It should queue and sample the records of the models like those of the app"""
+        service_logger = logging.getLogger("service")
+        saved = (service_logger.handlers, service_logger.level, service_logger.propagate)
+        self.addCleanup(self.restore_logger, service_logger, *saved)
+        app = self.make_app(name="service", LOG_FORMAT="json", LOG_QUEUE=True,
+                            LOG_SAMPLE_RATES="service.models=0.0")
+        self.assertIs(app.logger, service_logger)
+        models.logger.info("Processing lookup for id 1 ...")
+        models.logger.warning("Slow lookup for id 2")
+        listener = app.extensions["log_queue_listener"]
+        atexit.unregister(listener.stop)
+        listener.stop()  # flushes the queue
+        messages = [json.loads(line)["message"] for line in self.handler.lines]
+        self.assertIn("Slow lookup for id 2", messages)
+        self.assertNotIn("Processing lookup for id 1 ...", messages)
+
+    @staticmethod
+    def restore_logger(logger, handlers, level, propagate):
+        """Puts back the handlers and settings of a logger"""
+        logger.handlers = handlers
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+    def test_json_exception(self):
+        """It should include the exception in JSON records"""
+        formatter = JsonFormatter()
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            record = logging.LogRecord("x", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+        entry = json.loads(formatter.format(record))
+        self.assertIn("ValueError: boom", entry["exception"])
+
+    def test_sampling_filter(self):
+        """It should sample records below WARNING by logger"""
+        sampler = SamplingFilter({"service.models": 0.0, "sqlalchemy": 0.5})
+        self.assertEqual(sampler.rate("service.models"), 0.0)
+        self.assertEqual(sampler.rate("sqlalchemy.engine"), 0.5)
+        self.assertEqual(sampler.rate("other"), 1.0)
+        info = logging.LogRecord("service.models", logging.INFO, __file__, 1, "hello", None, None)
+        warning = logging.LogRecord("service.models", logging.WARNING, __file__, 1, "hello", None, None)
+        self.assertFalse(sampler.filter(info))
+        self.assertTrue(sampler.filter(warning))
+
+    def test_parse_sample_rates(self):
+        """It should parse sampling rates from the config"""
+        self.assertEqual(parse_sample_rates(""), {})
+        self.assertEqual(parse_sample_rates("service.models=0.1, sqlalchemy=0.01"), {"service.models": 0.1, "sqlalchemy": 0.01})
@@ -0,0 +1,101 @@
+"""
+Test cases for the SingleFlight utility
+
+"""
+import threading
+import time
+from unittest import TestCase
+from service.common.single_flight import SingleFlight
+
+
+######################################################################
+#  S I N G L E   F L I G H T   T E S T   C A S E S
+######################################################################
+class TestSingleFlight(TestCase):
+    """ Test Cases for SingleFlight """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.flight = SingleFlight()
+
+    def wait_for_coalesced(self, count):
+        """Waits until the given number of callers are waiting"""
+        for _ in range(500):
+            if self.flight.stats()["coalesced"] >= count:
+                return
+            time.sleep(0.01)
+        self.fail("callers were not coalesced")
+
+    def test_single_call(self):
+        """It should call the function when nothing is in flight"""
+        result, shared = self.flight.do("key", lambda x: x * 2, 21)
+        self.assertEqual(result, 42)
+        self.assertFalse(shared)
+        self.assertEqual(self.flight.stats(), {"requests": 1, "executions": 1, "coalesced": 0, "in_flight": 0})
+
+    def test_concurrent_calls_are_coalesced(self):
+        """It should share one execution between concurrent identical calls"""
+        release = threading.Event()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            release.wait(5)
+            return "result"
+
+        results = []
+
+        def caller():
+            results.append(self.flight.do("key", lookup))
+
+        threads = [threading.Thread(target=caller) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_coalesced(4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ["result"] * 5)
+        self.assertEqual(len([shared for _, shared in results if shared]), 4)
+        stats = self.flight.stats()
+        self.assertEqual(stats["executions"], 1)
+        self.assertEqual(stats["coalesced"], 4)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_different_keys_are_not_coalesced(self):
+        """It should not coalesce calls with different keys"""
+        self.flight.do("a", lambda: 1)
+        self.flight.do("b", lambda: 2)
+        self.assertEqual(self.flight.stats()["executions"], 2)
+
+    def test_error_is_shared(self):
+        """It should raise the error of the shared call to every caller"""
+        release = threading.Event()
+        errors = []
+
+        def lookup():
+            release.wait(5)
+            raise ValueError("boom")
+
+        def caller():
+            try:
+                self.flight.do("key", lookup)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=caller) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        self.wait_for_coalesced(2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(self.flight.stats()["in_flight"], 0)
+
+    def test_reset(self):
+        """It should reset the statistics"""
+        self.flight.do("key", lambda: None)
+        self.flight.reset()
+        self.assertEqual(self.flight.stats()["requests"], 0)
@@ -0,0 +1,159 @@
+"""
+Test cases for the WriteBehindQueue
+
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase
+from flask import Flask
+from service import app, routes
+from service.common.write_behind import WriteBehindQueue, QueueFull, PENDING, COMMITTED, FAILED
+from service.models import db, Recommendation
+from tests.factories import RecommendationFactory
+from tests.harness import DatabaseTestCase
+
+
+######################################################################
+#  W R I T E   B E H I N D   T E S T   C A S E S
+######################################################################
+class TestWriteBehindQueue(TestCase):
+    """ Test Cases for WriteBehindQueue """
+
+    def setUp(self):
+        """ This runs before each test """
+        self.app = Flask("tests")
+        self.batches = []
+        self.flushed = threading.Event()
+        self.spill_path = os.path.join(tempfile.mkdtemp(), "spill.ndjson")
+
+    def tearDown(self):
+        """ This runs after each test """
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        os.rmdir(os.path.dirname(self.spill_path))
+
+    def flush(self, items):
+        """Records a batch and fails on items marked bad"""
+        if any(item.get("bad") for item in items):
+            raise ValueError("bad item")
+        self.batches.append(list(items))
+        self.flushed.set()
+        return [item["n"] for item in items]
+
+    def make_queue(self, **kwargs):
+        """Creates a queue that flushes with self.flush"""
+        return WriteBehindQueue(self.app, self.flush, spill_path=self.spill_path, **kwargs)
+
+    def test_batches_are_flushed(self):
+        """It should flush queued writes together and commit their tickets"""
+        writes = self.make_queue(batch_size=10, flush_interval=0.2)
+        tickets = [writes.submit({"n": n}) for n in range(5)]
+        self.assertEqual(writes.status(tickets[0]), {"status": PENDING})
+        writes.start()
+        writes.stop()
+        self.assertEqual(self.batches, [[{"n": n} for n in range(5)]])
+        self.assertEqual(writes.status(tickets[3]), {"status": COMMITTED, "result": 3})
+        self.assertIsNone(writes.status("unknown"))
+
+    def test_failed_batch_is_retried_one_at_a_time(self):
+        """It should only fail the writes that cannot be flushed"""
+        writes = self.make_queue(batch_size=10, flush_interval=0.2)
+        good = writes.submit({"n": 1})
+        bad = writes.submit({"n": 2, "bad": True})
+        writes.start()
+        writes.stop()
+        self.assertEqual(writes.status(good)["status"], COMMITTED)
+        self.assertEqual(writes.status(bad), {"status": FAILED, "error": "bad item"})
+
+    def test_backpressure(self):
+        """It should refuse writes when the queue is full"""
+        writes = self.make_queue(maxsize=2)
+        writes.submit({"n": 1})
+        writes.submit({"n": 2})
+        self.assertRaises(QueueFull, writes.submit, {"n": 3})
+        self.assertEqual(writes.stats(), {"pending": 2, "capacity": 2})
+
+    def test_spill_and_restore(self):
+        """It should spill pending writes on stop and queue them again on start"""
+        writes = self.make_queue()
+        ticket = writes.submit({"n": 7})
+        writes.stop()
+        with open(self.spill_path, encoding="utf-8") as spill_file:
+            self.assertEqual(json.loads(spill_file.readline()), {"ticket": ticket, "item": {"n": 7}})
+        restarted = self.make_queue()
+        restarted.start()
+        self.assertTrue(self.flushed.wait(5))
+        restarted.stop()
+        self.assertFalse(os.path.exists(self.spill_path))
+        self.assertEqual(restarted.status(ticket), {"status": COMMITTED, "result": 7})
+
+    def test_spill_file_restored_once(self):
+        """It should queue a spill file again in only one of the workers sharing it"""
+        writes = self.make_queue()
+        writes.submit({"n": 7})
+        writes.stop()
+        first, second = self.make_queue(), self.make_queue()
+        first.restore()
+        second.restore()
+        self.assertEqual(first.stats()["pending"], 1)
+        self.assertEqual(second.stats()["pending"], 0)
+        self.assertEqual(os.listdir(os.path.dirname(self.spill_path)), [])
+
+    def test_restore_skips_truncated_line(self):
+        """It should queue the readable writes of a spill file cut off mid-line"""
+        with open(self.spill_path, "w", encoding="utf-8") as spill_file:
+            spill_file.write(json.dumps({"ticket": "t1", "item": {"n": 1}}) + "\n")
+            spill_file.write('{"ticket": "t2", "it')
+        writes = self.make_queue()
+        with self.assertLogs(self.app.logger, "ERROR") as logs:
+            writes.restore()
+        self.assertIn("Skipping unreadable line 2", logs.output[0])
+        self.assertEqual(writes.status("t1"), {"status": PENDING})
+        self.assertIsNone(writes.status("t2"))
+        self.assertEqual(os.listdir(os.path.dirname(self.spill_path)), [])
+
+    def test_restore_orphaned_claim(self):
+        """It should take over a spill file claimed by a worker that died"""
+        dead = subprocess.Popen([sys.executable, "-c", ""])  # pylint: disable=consider-using-with
+        dead.wait()
+        running = f"{self.spill_path}.1"  # init is always running
+        for path, ticket in ((f"{self.spill_path}.{dead.pid}", "orphan"), (running, "busy")):
+            with open(path, "w", encoding="utf-8") as spill_file:
+                spill_file.write(json.dumps({"ticket": ticket, "item": {"n": 1}}) + "\n")
+        writes = self.make_queue()
+        writes.restore()
+        self.assertEqual(writes.status("orphan"), {"status": PENDING})
+        self.assertIsNone(writes.status("busy"))
+        self.assertEqual(os.listdir(os.path.dirname(self.spill_path)), ["spill.ndjson.1"])
+        os.remove(running)
+
+
+######################################################################
+#  W R I T E   B E H I N D   D A T A B A S E   T E S T   C A S E S
+######################################################################
+class TestWriteBehindRecommendations(DatabaseTestCase):
+    """ Test Cases for flushing queued recommendations to the database """
+
+    # the flusher's rollback would also undo the test's transaction
+    transactional = False
+
+    def test_failed_batch_is_retried_one_at_a_time(self):
+        """It should commit the valid writes of a batch that failed in the database"""
+        index = db.Index("test_unique_recommendation_id", Recommendation.recommendationId, unique=True)
+        index.create(db.engine)
+        self.addCleanup(index.drop, db.engine)
+        self.addCleanup(db.session.remove)
+        RecommendationFactory(recommendationId=7).create()
+        writes = WriteBehindQueue(app, routes.flush_recommendations, batch_size=10, flush_interval=0.2)
+        items = [RecommendationFactory(recommendationId=rec_id).serialize() for rec_id in (8, 7, 9)]
+        tickets = [writes.submit(item) for item in items]
+        writes.start()
+        writes.stop()
+        self.assertEqual([writes.status(ticket)["status"] for ticket in tickets], [COMMITTED, FAILED, COMMITTED])
+        self.assertIn("UNIQUE", writes.status(tickets[1])["error"].upper())
+        self.assertEqual(sorted(rec.recommendationId for rec in Recommendation.all()), [7, 8, 9])
+